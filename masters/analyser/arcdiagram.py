@@ -5,15 +5,15 @@ from masters import settings
 sql = """
     select user_link, region_name, province_name, review_experience_date, review_id 
 from reviews
-         join locations l on l.attraction_url = reviews.parent_url
-         join provinces p on p.province_url = l.attraction_parent_url
-where country = 'slovenia'
-  and reviews.review_date > 20200101
-  and reviews.review_date < 20210101
+         join locations l on l.location_id = reviews.location_id
+         join provinces p on p.province_id = l.province_id
+where country = ?
+  and reviews.review_date > ?
+  and reviews.review_date < ?
 order by user_link, review_experience_date, review_id
     """
 connection = database_utils.create_connection("../data/databases/data.db")
-data = database_utils.get_data(connection, sql)
+data = database_utils.get_data(connection, sql, ('slovenia', 20200101, 20210101))
 
 
 def get_color(region_name):
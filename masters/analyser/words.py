@@ -3,11 +3,11 @@ import matplotlib.pyplot as plt
 from masters.data_managers.utils import database_utils
 
 # Get data
-sql = """select review_location_type from provinces join locations l on provinces.province_url = l.attraction_parent_url
-join reviews r on l.attraction_url = r.parent_url
-where country = 'slovenia'"""
+sql = """select review_location_type from provinces join locations l on provinces.province_id = l.province_id
+join reviews r on l.location_id = r.location_id
+where country = ?"""
 connection = database_utils.create_connection("../data/databases/data.db")
-data = database_utils.get_data(connection, sql)
+data = database_utils.get_data(connection, sql, ('slovenia',))
 
 # Create a list of word
 text = (
@@ -0,0 +1,238 @@
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+sys.path.append("..")
+
+from masters import settings
+from masters.data_managers.utils import database_schema
+from masters.data_managers.utils.database_sink import DatabaseSink
+from masters.managers import fingerprint_manager
+
+# Every country has its own database (<country>.db with its provinces, locations and reviews) in
+# DATABASE_PARTITIONS, so countries are written by parallel writers. With DATABASE_PARTITION_YEARS reviews of
+# every year go to <country>_<year>.db. Partitions are listed in catalogue.db of the folder and are read together
+# through database_utils.create_partitioned_connection.
+#
+#     python data_managers/utils/database_partitions.py split data/databases/data.db
+#     python data_managers/utils/database_partitions.py list
+
+catalogue_file = "catalogue.db"
+
+sql_create_partitions_table = """ CREATE TABLE IF NOT EXISTS partitions (
+                                    name text,
+                                    country text,
+                                    year integer,
+                                    filename text,
+                                    updated_at real,
+                                    PRIMARY KEY (name)
+                                ); """
+
+
+def get_country_name(country):
+    # aus -> austria, names are kept as they are
+    return settings.COUNTRY_NAMES.get(country, country)
+
+
+def get_partition_name(country, year=None):
+    if year is None:
+        return get_country_name(country)
+    return "%s_%s" % (get_country_name(country), year)
+
+
+def get_partition_path(country, year=None, folder=settings.DATABASE_PARTITIONS):
+    return os.path.join(folder, get_partition_name(country, year) + ".db")
+
+
+def open_catalogue(folder=settings.DATABASE_PARTITIONS):
+    # Catalogue is shared by parallel loaders
+    os.makedirs(folder, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(folder, catalogue_file), timeout=60)
+    conn.execute(sql_create_partitions_table)
+    return conn
+
+
+def register_partition(country, year=None, folder=settings.DATABASE_PARTITIONS):
+    conn = open_catalogue(folder)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO partitions VALUES(?, ?, ?, ?, ?)", (
+            get_partition_name(country, year), get_country_name(country), year,
+            get_partition_name(country, year) + ".db", time.time()))
+    conn.close()
+
+
+def create_partition(country, year=None, folder=settings.DATABASE_PARTITIONS):
+    # Creates (or opens) the partition database and lists it in the catalogue, returns its path
+    os.makedirs(folder, exist_ok=True)
+    path = get_partition_path(country, year, folder)
+    conn = sqlite3.connect(path)
+    database_schema.create_database(conn)
+    conn.close()
+    register_partition(country, year, folder)
+    return path
+
+
+def get_partitions(countries=None, years=None, folder=settings.DATABASE_PARTITIONS):
+    # (name, country, year, path) of the partitions of countries (codes or names, None - all). Review partitions
+    # of other than given years are left out, country partitions are always included.
+    if not os.path.exists(os.path.join(folder, catalogue_file)):
+        return []
+    conn = open_catalogue(folder)
+    rows = conn.execute("SELECT name, country, year, filename FROM partitions ORDER BY country, year").fetchall()
+    conn.close()
+    names = None if countries is None else set(get_country_name(country) for country in countries)
+    partitions = []
+    for name, country, year, filename in rows:
+        if names is not None and country not in names:
+            continue
+        if years is not None and year is not None and year not in years:
+            continue
+        partitions.append((name, country, year, os.path.join(folder, filename)))
+    return partitions
+
+
+def get_review_year(row):
+    # Year of a reviews row (review_date is yyyymmdd), None when the date is missing
+    review_date = row[database_schema.columns['reviews'].index('review_date')]
+    if review_date is None:
+        return None
+    return review_date // 10000
+
+
+class PartitionedSink(object):
+    # DatabaseSink of one country writing to its partition, reviews are split by year with
+    # DATABASE_PARTITION_YEARS. Partitions are created and listed in the catalogue when their first row comes.
+
+    def __init__(self, country=settings.COUNTRY, folder=settings.DATABASE_PARTITIONS,
+                 batch_size=settings.DATABASE_BATCH, years=settings.DATABASE_PARTITION_YEARS):
+        self.country = country
+        self.folder = folder
+        self.batch_size = batch_size
+        self.years = years
+        self.lock = threading.Lock()
+        self.sinks = {}
+
+    def get_sink(self, year=None):
+        with self.lock:
+            if year not in self.sinks:
+                self.sinks[year] = DatabaseSink(create_partition(self.country, year, self.folder), self.batch_size)
+            return self.sinks[year]
+
+    def add(self, table, row):
+        year = None
+        if self.years and table == 'reviews':
+            year = get_review_year(row)
+        self.get_sink(year).add(table, row)
+
+    def add_provinces(self, provinces, country):
+        for province in provinces:
+            self.add('provinces', province.get_db_row(country))
+
+    def add_locations(self, locations):
+        for location in locations:
+            self.add('locations', location.get_db_row())
+
+    def add_reviews(self, reviews):
+        for review in reviews:
+            self.add('reviews', review.get_db_row())
+
+    def mark_fetched(self, fingerprint):
+        # Rows of a page can be buffered in several partitions (years), page is marked once all of them committed
+        with self.lock:
+            sinks = [sink for sink in self.sinks.values() if sink.buffered]
+        if not sinks:
+            fingerprint_manager.mark_fingerprint(fingerprint)
+            return
+        remaining = [len(sinks)]
+
+        def committed():
+            with self.lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            fingerprint_manager.mark_fingerprint(fingerprint)
+        for sink in sinks:
+            sink.on_commit(committed)
+
+    @property
+    def written(self):
+        return sum(sink.written for sink in list(self.sinks.values()))
+
+    def flush(self):
+        for sink in list(self.sinks.values()):
+            sink.flush()
+
+    def close(self):
+        for sink in list(self.sinks.values()):
+            sink.close()
+
+
+def create_sink(country=settings.COUNTRY):
+    # Sink used by scrapers: partitions of the country when DATABASE_PARTITIONED, DATABASE otherwise
+    if settings.DATABASE_PARTITIONED:
+        return PartitionedSink(country)
+    return DatabaseSink()
+
+
+def split_database(db_file, folder=settings.DATABASE_PARTITIONS, years=settings.DATABASE_PARTITION_YEARS):
+    # Copies every country of db_file to its partitions. Locations and reviews go with the province and location
+    # they belong to, those without one are left out.
+    source = sqlite3.connect(db_file)
+    countries = [row[0] for row in source.execute("SELECT DISTINCT country FROM provinces WHERE country IS NOT NULL")]
+    source.close()
+
+    columns = dict((table, ", ".join(database_schema.columns[table])) for table in database_schema.columns)
+    for country in countries:
+        start_time = time.time()
+        conn = sqlite3.connect(create_partition(country, None, folder))
+        conn.execute("ATTACH DATABASE ? AS source", (db_file,))
+        conn.execute("INSERT OR REPLACE INTO provinces SELECT %s FROM source.provinces WHERE country = ?" % (
+            columns['provinces']), (country,))
+        conn.execute("""INSERT OR REPLACE INTO locations SELECT %s FROM source.locations
+                        WHERE province_id IN (SELECT province_id FROM main.provinces)""" % columns['locations'])
+        condition = "review_date IS NULL" if years else "1 = 1"
+        conn.execute("""INSERT OR REPLACE INTO reviews SELECT %s FROM source.reviews
+                        WHERE location_id IN (SELECT location_id FROM main.locations) AND %s""" % (
+            columns['reviews'], condition))
+        conn.commit()
+        review_years = []
+        if years:
+            review_years = [row[0] for row in conn.execute(
+                """SELECT DISTINCT review_date / 10000 FROM source.reviews
+                   WHERE location_id IN (SELECT location_id FROM main.locations) AND review_date IS NOT NULL""")]
+        for year in review_years:
+            conn.execute("ATTACH DATABASE ? AS target", (create_partition(country, year, folder),))
+            conn.execute("""INSERT OR REPLACE INTO target.reviews SELECT %s FROM source.reviews
+                            WHERE location_id IN (SELECT location_id FROM main.locations)
+                              AND review_date >= ? AND review_date < ?""" % columns['reviews'],
+                         (year * 10000, (year + 1) * 10000))
+            conn.commit()
+            conn.execute("DETACH DATABASE target")
+        conn.close()
+        print("%s in %.1f s" % (get_partition_name(country), time.time() - start_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-country database partitions")
+    parser.add_argument("--folder", default=settings.DATABASE_PARTITIONS)
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("list", help="partitions in the catalogue")
+    split_parser = subparsers.add_parser("split", help="copy a database to per-country partitions")
+    split_parser.add_argument("db", nargs="?", default=settings.DATABASE)
+    split_parser.add_argument("--years", action="store_true", default=settings.DATABASE_PARTITION_YEARS,
+                              help="reviews of every year in their own partition")
+    args = parser.parse_args()
+
+    if args.command == "split":
+        split_database(args.db, args.folder, args.years)
+    else:
+        for name, country, year, path in get_partitions(folder=args.folder):
+            size = os.path.getsize(path) // (1024 * 1024) if os.path.exists(path) else None
+            print("%s: %s MB (%s)" % (name, size, path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import itertools
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.request import pathname2url
+
+from masters import settings
+from masters.data_managers.utils import database_partitions
+from masters.data_managers.utils import database_schema
+from masters.data_managers.utils import database_utils
+from masters.data_structures.Attraction import Attraction
+from masters.data_structures.Province import Province
+from masters.data_structures.Review import Review
+
+# Streaming queries over scraped data. Rows are fetched in batches (fetchmany) and optionally turned into typed
+# records, so analysis of the whole reviews table runs in constant memory.
+#
+#     for review in database_queries.iter_reviews('slo', start_date=20200101, end_date=20210101):
+#         ...
+#
+# Connections are read only and shared by the threads of a process, at most cache_size of them are kept in the cache.
+
+batch_size = 1000
+cache_size = 4
+
+record_factories = {
+    'provinces': Province.from_db_row,
+    'locations': Attraction.from_db_row,
+    'reviews': Review.from_db_row,
+}
+
+connections = OrderedDict()
+connections_lock = threading.Lock()
+
+
+def open_read_only(db_file):
+    return sqlite3.connect("file:%s?mode=ro" % pathname2url(os.path.abspath(db_file)), uri=True,
+                           check_same_thread=False)
+
+
+def get_connection(db_file=None, countries=None, partitions=None):
+    # Shared read only connection to db_file, by default to DATABASE or to the partitions of countries (or the given
+    # partitions, database_utils.get_partition_batches) when DATABASE_PARTITIONED. The least recently used connection leaves the cache when more than cache_size are cached,
+    # it is not closed as queries can still be streaming from it (it is closed once they are garbage collected).
+    if db_file is not None:
+        key = ('file', os.path.abspath(db_file))
+    elif settings.DATABASE_PARTITIONED and partitions is not None:
+        key = ('batch', tuple(partition[3] for partition in partitions))
+    elif settings.DATABASE_PARTITIONED:
+        key = ('partitions', tuple(sorted(countries)) if countries else None)
+    else:
+        key = ('file', os.path.abspath(settings.DATABASE))
+    with connections_lock:
+        conn = connections.pop(key, None)
+        if conn is None:
+            if key[0] == 'batch':
+                conn = database_utils.create_partitioned_connection(partitions=partitions)
+            elif key[0] == 'partitions':
+                conn = database_utils.create_partitioned_connection(countries)
+            else:
+                conn = open_read_only(key[1])
+        connections[key] = conn
+        while len(connections) > cache_size:
+            connections.popitem(last=False)
+    return conn
+
+
+def close_connections():
+    with connections_lock:
+        while connections:
+            connections.popitem()[1].close()
+
+
+def iter_query(sql, parameters=(), row_factory=None, conn=None):
+    # Rows of a parameterised query, row_factory(row) of every row when given
+    if conn is None:
+        conn = get_connection()
+    rows = database_utils.iter_cursor(conn.execute(sql, parameters), batch_size)
+    if row_factory is None:
+        return rows
+    return (row_factory(row) for row in rows)
+
+
+def iter_table(table, where=None, parameters=(), records=True, conn=None):
+    # Records (or rows in database_schema.columns order) of a table, where is an sql condition with ? parameters
+    sql = "SELECT %s FROM %s" % (", ".join(database_schema.columns[table]), table)
+    if where:
+        sql += " WHERE " + where
+    return iter_query(sql, parameters, record_factories[table] if records else None, conn)
+
+
+def get_country_condition(table):
+    # Sql condition on rows of the table belonging to the country given as parameter
+    if table == 'provinces':
+        return "country = ?"
+    provinces = "SELECT province_id FROM provinces WHERE country = ?"
+    if table == 'locations':
+        return "province_id IN (%s)" % provinces
+    return "location_id IN (SELECT location_id FROM locations WHERE province_id IN (%s))" % provinces
+
+
+def get_country_connections(country, conn=None):
+    # Given connection, or shared connections reading only the partitions of the country. Review years which don't
+    # fit on one connection are spread over several, every one of them has all provinces and locations.
+    if conn is not None:
+        return [conn]
+    countries = [country] if country is not None else None
+    if not settings.DATABASE_PARTITIONED:
+        return [get_connection()]
+    return [get_connection(partitions=partitions) for partitions in database_utils.get_partition_batches(countries)]
+
+
+def iter_provinces(country=None, records=True, conn=None):
+    conn = get_country_connections(country, conn)[0]
+    if country is None:
+        return iter_table('provinces', records=records, conn=conn)
+    return iter_table('provinces', get_country_condition('provinces'),
+                      (database_partitions.get_country_name(country),), records, conn)
+
+
+def iter_locations(country=None, records=True, conn=None):
+    conn = get_country_connections(country, conn)[0]
+    if country is None:
+        return iter_table('locations', records=records, conn=conn)
+    return iter_table('locations', get_country_condition('locations'),
+                      (database_partitions.get_country_name(country),), records, conn)
+
+
+def iter_reviews(country=None, start_date=None, end_date=None, records=True, conn=None):
+    # Reviews of a country (code or name) written in [start_date, end_date) (yyyymmdd)
+    conditions = []
+    parameters = []
+    if country is not None:
+        conditions.append(get_country_condition('reviews'))
+        parameters.append(database_partitions.get_country_name(country))
+    if start_date is not None:
+        conditions.append("review_date >= ?")
+        parameters.append(start_date)
+    if end_date is not None:
+        conditions.append("review_date < ?")
+        parameters.append(end_date)
+    return itertools.chain.from_iterable(
+        iter_table('reviews', " AND ".join(conditions), tuple(parameters), records, connection)
+        for connection in get_country_connections(country, conn))
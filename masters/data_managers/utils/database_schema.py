@@ -0,0 +1,143 @@
+# Tables are keyed by the integer ids of their urls (g<geo id> of provinces, d<detail id> of locations),
+# urls are kept as plain attributes. Dates (yyyymmdd), pages and ids are integers, rates and coordinates reals.
+#
+# The schema version is kept in PRAGMA user_version: 0 - text columns keyed by urls, 1 - integer ids,
+# 2 - typed columns. Older databases are moved to the current version with migrate_schema.py.
+
+version = 2
+
+provinces_columns = ('province_name', 'region_name', 'province_url', 'country', 'province_id')
+
+locations_columns = ('attraction_name', 'attraction_rate', 'attraction_type', 'attraction_url', 'attraction_parent_url',
+                     'location_id', 'geo_id', 'province_id')
+
+reviews_columns = ('review_location_name', 'review_current_page', 'review_last_page', 'review_location_type',
+                   'review_location_breadcrumbs', 'review_location_rate', 'location_lat', 'location_lng', 'review_id',
+                   'review_date', 'review_experience_date', 'review_rate', 'user_name', 'user_link', 'user_id',
+                   'extra', 'parent_url', 'location_id')
+
+columns = {
+    'provinces': provinces_columns,
+    'locations': locations_columns,
+    'reviews': reviews_columns,
+}
+
+sql_create_provinces_table = """ CREATE TABLE IF NOT EXISTS provinces (
+                                    province_name text,
+                                    region_name text,
+                                    province_url text,
+                                    country text,
+                                    province_id integer,
+                                    PRIMARY KEY (province_id)
+                                ); """
+
+sql_create_locations_table = """ CREATE TABLE IF NOT EXISTS locations (
+                                    attraction_name text,
+                                    attraction_rate real,
+                                    attraction_type text,
+                                    attraction_url text,
+                                    attraction_parent_url text,
+                                    location_id integer,
+                                    geo_id integer,
+                                    province_id integer,
+                                    PRIMARY KEY (location_id),
+                                    FOREIGN KEY (province_id) REFERENCES provinces (province_id)
+                                ); """
+
+sql_create_review_table = """ CREATE TABLE IF NOT EXISTS reviews (
+                                    review_location_name text,
+                                    review_current_page integer,
+                                    review_last_page integer,
+                                    review_location_type text,
+                                    review_location_breadcrumbs text,
+                                    review_location_rate real,
+                                    location_lat real,
+                                    location_lng real,
+                                    review_id integer,
+                                    review_date integer,
+                                    review_experience_date integer,
+                                    review_rate real,
+                                    user_name text,
+                                    user_link text,
+                                    user_id text,
+                                    extra text,
+                                    parent_url text,
+                                    location_id integer,
+                                    PRIMARY KEY (review_id),
+                                    FOREIGN KEY (location_id) REFERENCES locations (location_id)
+                                ); """
+
+# Columns which have to be set for a row to be stored
+id_columns = {
+    'provinces': ('province_id',),
+    'locations': ('location_id',),
+    'reviews': ('review_id', 'location_id'),
+}
+
+tables = {
+    'provinces': sql_create_provinces_table,
+    'locations': sql_create_locations_table,
+    'reviews': sql_create_review_table,
+}
+
+indexes = {
+    'provinces_country': "CREATE INDEX IF NOT EXISTS provinces_country ON provinces(country)",
+    'locations_province_id': "CREATE INDEX IF NOT EXISTS locations_province_id ON locations(province_id)",
+    'locations_attraction_parent_url':
+        "CREATE INDEX IF NOT EXISTS locations_attraction_parent_url ON locations(attraction_parent_url)",
+    'reviews_location_id': "CREATE INDEX IF NOT EXISTS reviews_location_id ON reviews(location_id)",
+    'reviews_parent_url': "CREATE INDEX IF NOT EXISTS reviews_parent_url ON reviews(parent_url)",
+    'reviews_review_date': "CREATE INDEX IF NOT EXISTS reviews_review_date ON reviews(review_date)",
+    'reviews_user_link_experience_date':
+        "CREATE INDEX IF NOT EXISTS reviews_user_link_experience_date ON reviews(user_link, review_experience_date)",
+}
+
+
+def get_insert_sql(table):
+    return "INSERT OR REPLACE INTO %s(%s) VALUES(%s)" % (
+        table, ", ".join(columns[table]), ",".join("?" * len(columns[table])))
+
+
+def create_indexes(conn):
+    for sql in indexes.values():
+        conn.execute(sql)
+
+
+def drop_indexes(conn):
+    for name in indexes:
+        conn.execute("DROP INDEX IF EXISTS %s" % name)
+
+
+def get_id_indexes(table):
+    # Positions of id_columns[table] in rows of the table
+    return [columns[table].index(column) for column in id_columns[table]]
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def set_version(conn, schema_version):
+    conn.execute("PRAGMA user_version = %d" % schema_version)
+
+
+def has_table(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def get_database_file(conn):
+    return conn.execute("PRAGMA database_list").fetchone()[2]
+
+
+def create_database(conn):
+    # Creates missing tables, a new database gets the current version. A database of an older version has to be
+    # migrated first (migrate_schema.py), its tables don't have the columns of the indexes.
+    if not any(has_table(conn, table) for table in tables):
+        set_version(conn, version)
+    elif get_version(conn) < version:
+        raise ValueError("Database %s has schema version %s instead of %s, migrate it with "
+                         "data_managers/utils/migrate_schema.py" % (get_database_file(conn), get_version(conn), version))
+    for table in ('provinces', 'locations', 'reviews'):
+        conn.execute(tables[table])
+    create_indexes(conn)
+    conn.commit()
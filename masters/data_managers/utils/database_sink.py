@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import threading
+
+from masters import settings
+from masters.data_managers.utils import database_schema
+from masters.managers import fingerprint_manager
+
+
+class DatabaseSink(object):
+    # Buffers rows of provinces, locations and reviews and writes them to the database with one executemany
+    # per table inside a single transaction once batch_size rows are buffered. Shared by the scrapy pipeline
+    # and the gecko workers (thread safe). Rows without id (csv headers, broken urls, reviews without review_id) are dropped,
+    # locations without reviews are kept as a row with a negative review_id (Review.get_placeholder_id).
+    # Pages are marked as downloaded only once their rows are committed (mark_fetched).
+
+    def __init__(self, db_file=settings.DATABASE, batch_size=settings.DATABASE_BATCH):
+        folder = os.path.dirname(db_file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = dict((table, []) for table in database_schema.columns)
+        self.buffered = 0
+        self.written = 0
+        # Called after the next commit
+        self.commit_callbacks = []
+        self.id_indexes = dict((table, database_schema.get_id_indexes(table)) for table in database_schema.columns)
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        database_schema.create_database(self.conn)
+
+    def add(self, table, row):
+        # row holds the values of database_schema.columns[table] in that order
+        if any(row[i] is None for i in self.id_indexes[table]):
+            return
+        with self.lock:
+            self.pending[table].append(row)
+            self.buffered += 1
+            if self.buffered >= self.batch_size:
+                self._flush()
+
+    def add_provinces(self, provinces, country):
+        for province in provinces:
+            self.add('provinces', province.get_db_row(country))
+
+    def add_locations(self, locations):
+        for location in locations:
+            self.add('locations', location.get_db_row())
+
+    def add_reviews(self, reviews):
+        for review in reviews:
+            self.add('reviews', review.get_db_row())
+
+    def on_commit(self, callback):
+        # callback() runs once the rows buffered so far are committed, right away when nothing is buffered
+        with self.lock:
+            if self.buffered:
+                self.commit_callbacks.append(callback)
+                return
+        callback()
+
+    def mark_fetched(self, fingerprint):
+        # Page whose rows were added is skipped by later crawls once they are in the database, a crash with
+        # rows in the buffer leaves it to be downloaded again
+        self.on_commit(lambda: fingerprint_manager.mark_fingerprint(fingerprint))
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffered:
+            return
+        with self.conn:
+            for table, rows in self.pending.items():
+                if rows:
+                    self.conn.executemany(database_schema.get_insert_sql(table), rows)
+        self.written += self.buffered
+        self.pending = dict((table, []) for table in database_schema.columns)
+        self.buffered = 0
+        callbacks, self.commit_callbacks = self.commit_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
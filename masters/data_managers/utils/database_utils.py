@@ -3,29 +3,57 @@ import codecs
 import os
 import re
 
+from urllib.request import pathname2url
+
+from masters import settings
+from masters.data_managers.utils import database_partitions
+from masters.data_managers.utils import database_schema
+from masters.utils import url_utils
+from masters.utils.type_utils import to_int
+
 
 def get_review_by_location_name(conn, review_name):
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM reviews WHERE location_name = ?", (review_name,))
-    for row in cur.fetchall():
-        return row
+    return conn.execute("SELECT * FROM reviews WHERE review_location_name = ? LIMIT 1", (review_name,)).fetchone()
 
 
-def get_data(conn, sql):
-    cur = conn.cursor()
-    cur.execute(sql)
-    return cur.fetchall()
+def iter_cursor(cur, batch_size=1000):
+    # Rows of an executed cursor fetched batch_size rows at a time, the cursor is closed at the end
+    try:
+        rows = cur.fetchmany(batch_size)
+        while rows:
+            for row in rows:
+                yield row
+            rows = cur.fetchmany(batch_size)
+    finally:
+        cur.close()
 
 
-def get_location_urls(conn):
-    cur = conn.cursor()
+def get_data(conn, sql, parameters=()):
+    # Rows of a parameterised query, streamed
+    return iter_cursor(conn.execute(sql, parameters))
+
+
+def get_location_urls(conn, country=settings.COUNTRY):
+    # (attraction_url, location_id) of all locations of country (code or name), streamed
     sql = """
-        select * from provinces p
-        join locations l on p.province_url = l.attraction_parent_url
-        where country = 'italy'
+        select l.attraction_url, l.location_id from provinces p
+        join locations l on p.province_id = l.province_id
+        where country = ?
     """
-    cur.execute(sql)
-    return cur.fetchall()
+    return get_data(conn, sql, (database_partitions.get_country_name(country),))
+
+
+def get_known_review_ids(conn, parent_url):
+    cur = conn.cursor()
+    cur.execute("SELECT review_id FROM reviews WHERE location_id = ?", (url_utils.get_location_id(parent_url),))
+    return set(to_int(row[0]) for row in cur)
+
+
+def get_review_page_counts(conn):
+    # review_last_page of every location which has reviews, keyed by location_id
+    cur = conn.cursor()
+    cur.execute("SELECT location_id, MAX(CAST(review_last_page AS INTEGER)) FROM reviews GROUP BY location_id")
+    return dict(cur.fetchall())
 
 
 def correct_data(conn, line):
@@ -74,6 +102,94 @@ def create_connection(db_file):
         print(e)
     return conn
 
+
+def get_attach_limit(conn):
+    # Raised to the most SQLite was compiled with (SQLITE_MAX_ATTACHED, 10 by default and at most 125)
+    if not hasattr(conn, "setlimit"):
+        return 10
+    conn.setlimit(sqlite3.SQLITE_LIMIT_ATTACHED, 125)
+    return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+
+
+def get_partition_batches(countries=None, years=None, folder=settings.DATABASE_PARTITIONS, limit=None):
+    # Partitions of countries split into batches which can be attached to one connection. Every batch has all
+    # country partitions (provinces, locations) and some of the review year partitions.
+    if limit is None:
+        conn = sqlite3.connect(":memory:")
+        limit = get_attach_limit(conn)
+        conn.close()
+    partitions = database_partitions.get_partitions(countries, years, folder)
+    country_partitions = [partition for partition in partitions if partition[2] is None]
+    year_partitions = [partition for partition in partitions if partition[2] is not None]
+    size = limit - len(country_partitions)
+    if size < 0 or (size == 0 and year_partitions):
+        raise ValueError("%s country partitions but at most %s databases can be attached, select fewer countries" % (
+            len(country_partitions), limit))
+    if not year_partitions:
+        return [country_partitions]
+    return [country_partitions + year_partitions[i:i + size] for i in range(0, len(year_partitions), size)]
+
+
+def create_partitioned_connection(countries=None, years=None, folder=settings.DATABASE_PARTITIONS, partitions=None):
+    # Read only connection to the partitions of countries (codes or names, None - all) and review years (None - all,
+    # () - none), or to the given partitions (get_partition_batches). Partitions are attached as p0, p1, ... and
+    # tables provinces, locations and reviews are views over all of them, so queries of one country read only its
+    # partitions. Partitions which don't fit on one connection are read with iter_data_connections.
+    if partitions is None:
+        partitions = database_partitions.get_partitions(countries, years, folder)
+    conn = sqlite3.connect(":memory:", uri=True, check_same_thread=False)
+    limit = get_attach_limit(conn)
+    if len(partitions) > limit:
+        conn.close()
+        raise ValueError("%s partitions but at most %s can be attached, select fewer countries or years" % (
+            len(partitions), limit))
+    for i, (name, country, year, path) in enumerate(partitions):
+        conn.execute("ATTACH DATABASE ? AS p%d" % i, ("file:%s?mode=ro" % pathname2url(os.path.abspath(path)),))
+    for table, columns in database_schema.columns.items():
+        if not partitions:
+            conn.execute(database_schema.tables[table])
+            continue
+        selects = ["SELECT %s FROM p%d.%s" % (", ".join(columns), i, table) for i in range(len(partitions))]
+        conn.execute("CREATE TEMP VIEW %s AS %s" % (table, " UNION ALL ".join(selects)))
+    return conn
+
+
+def create_data_connection(countries=None, reviews=True):
+    # Connection to scraped data: DATABASE, or partitions of countries when DATABASE_PARTITIONED. Without reviews
+    # review year partitions are left out (provinces and locations only).
+    if settings.DATABASE_PARTITIONED:
+        return create_partitioned_connection(countries, None if reviews else ())
+    return create_connection(settings.DATABASE)
+
+
+def iter_data_connections(countries=None):
+    # Connections which together hold all scraped data of countries: DATABASE, or batches of partitions
+    # (get_partition_batches) when there are more review years than SQLite attaches. Callers close them.
+    if not settings.DATABASE_PARTITIONED:
+        yield create_connection(settings.DATABASE)
+        return
+    for partitions in get_partition_batches(countries):
+        yield create_partitioned_connection(partitions=partitions)
+
+
+def load_known_review_ids(parent_url, countries=None):
+    # get_known_review_ids over all data of countries
+    known_ids = set()
+    for conn in iter_data_connections(countries):
+        known_ids.update(get_known_review_ids(conn, parent_url))
+        conn.close()
+    return known_ids
+
+
+def load_review_page_counts(countries=None):
+    # get_review_page_counts over all data of countries
+    page_counts = {}
+    for conn in iter_data_connections(countries):
+        for location_id, pages in get_review_page_counts(conn).items():
+            page_counts[location_id] = max(pages or 0, page_counts.get(location_id) or 0)
+        conn.close()
+    return page_counts
+
 #
 # do 17 10 je treba dobit temo
 #
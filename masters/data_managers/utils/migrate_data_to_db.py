@@ -1,66 +1,57 @@
-import sqlite3
-import codecs
+import argparse
+import io
+import multiprocessing
 import os
+import re
+import sqlite3
+import sys
+import time
 import zipfile
 
-from masters.utils import unicode_utils
+sys.path.append("../../..")
+
+from masters import settings
+from masters.data_managers.utils import database_partitions
+from masters.data_managers.utils import database_schema
+from masters.data_structures.Attraction import Attraction
+from masters.data_structures.Province import Province
+from masters.data_structures.Review import Review
+
+# Bulk load of scraped csv files (zip archives or folders) into the database
+#
+#     python migrate_data_to_db.py provinces ../../data/provinces/provinces_ita.zip
+#     python migrate_data_to_db.py locations ../../data/locations/locations_slo.zip
+#     python migrate_data_to_db.py reviews ../../data/reviews/reviews_ukr.old.zip ../../scraped_data/data_reviews/ukr
+#
+# Rows are streamed from the archives and inserted with executemany inside one transaction, indexes are
+# dropped for the load and created again afterwards. With --partitioned every country is loaded to its own
+# database (database_partitions.py) by a separate process.
+#
+#     python migrate_data_to_db.py reviews ../../data/reviews/*.zip --partitioned --jobs 4
 
 db = "../../data/databases/data.db"
+partitions = "../../data/databases/partitions"
+
+records = {
+    'provinces': Province,
+    'locations': Attraction,
+    'reviews': Review,
+}
+
+# provinces_ita.zip, reviews_ukr.old.zip, ... -> ita, ukr
+country_pattern = re.compile(r"_([a-z]{3})[._]")
 
 
 def create_database():
     database = db
 
-    sql_create_provinces_table = """ CREATE TABLE IF NOT EXISTS provinces (
-                                        province_name text,
-                                        region_name text,
-                                        province_url text,
-                                        country text,
-                                        PRIMARY KEY (province_url)                                        
-                                    ); """
-
-    sql_create_locations_table = """ CREATE TABLE IF NOT EXISTS locations (
-                                        attraction_name text,
-                                        attraction_rate text,
-                                        attraction_type text,
-                                        attraction_url text,
-                                        attraction_parent_url text,
-                                        PRIMARY KEY (attraction_url),    
-                                        FOREIGN KEY (attraction_parent_url) REFERENCES provinces (province_url)                                    
-                                    ); """
-
-    sql_create_review_table = """ CREATE TABLE IF NOT EXISTS reviews (
-                                        review_location_name text,
-                                        review_current_page text,
-                                        review_last_page text,
-                                        review_location_type text,
-                                        review_location_breadcrumbs text,
-                                        review_location_rate text,
-                                        location_lat text,
-                                        location_lng text,
-                                        review_id text,
-                                        review_date text,
-                                        review_experience_date text,
-                                        review_rate text,
-                                        user_name text,
-                                        user_link text,
-                                        user_id text,
-                                        extra text,
-                                        parent_url text,
-                                        PRIMARY KEY (review_id),    
-                                        FOREIGN KEY (parent_url) REFERENCES locations (attraction_url)                                    
-                                    ); """
     # create a database connection
     conn = create_connection(database)
 
     # create tables
     if conn is not None:
-        # create provinces table
-        create_table(conn, sql_create_provinces_table)
-        # create locations table
-        create_table(conn, sql_create_locations_table)
-        # create review table
-        create_table(conn, sql_create_review_table)
+        # create provinces, locations and review tables
+        database_schema.create_database(conn)
     else:
         print("Error! cannot create the database connection.")
 
@@ -93,96 +84,186 @@ def create_table(conn, create_table_sql):
         print(e)
 
 
-def insert_province(conn, province):
-    print("Inserting province: " + province[0])
-    sql = ''' INSERT OR REPLACE INTO provinces(province_name, region_name, province_url, country)
-              VALUES(?,?,?,?) '''
-    cur = conn.cursor()
-    cur.execute(sql, province)
-
-
-def insert_location(conn, location):
-    print("Inserting location: " + location[0])
-    sql = ''' INSERT OR REPLACE INTO locations(attraction_name, attraction_rate, attraction_type, attraction_url, attraction_parent_url)
-              VALUES(?,?,?,?,?) '''
-    cur = conn.cursor()
-    cur.execute(sql, location)
-
-
-def insert_review(conn, review):
-    print("Inserting review: " + review[0])
-    sql = ''' INSERT OR REPLACE INTO reviews(review_location_name, review_current_page, review_last_page,
-                    review_location_type, review_location_breadcrumbs, review_location_rate, location_lat,
-                    location_lng, review_id, review_date, review_experience_date,
-                    review_rate, user_name, user_link, user_id, extra, parent_url)
-              VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?) '''
-    cur = conn.cursor()
-    cur.execute(sql, review)
-
-
-def fill_provinces(folder, country):
-    conn = create_connection(db)
-    counter = 0
-    for file in os.listdir(folder):
-        file = folder + "/" + file
-        with open(file) as f:
-            line = f.readline()
-            while line:
-                line = line.replace("\n", "")
-                print(counter)
-                counter = counter + 1
-                insert_province(conn, tuple(line.split(", ")) + (country,))
-                line = f.readline()
-    conn.commit()
-
-
-def fill_locations(folder):
-    conn = create_connection(db)
-    counter = 0
-    for file in os.listdir(folder):
-        file = folder + "/" + file
-        with open(file) as f:
-            line = f.readline()
-            while line:
-                line = line.replace("\n", "")
-                print(counter)
-                counter += 1
-                insert_location(conn, tuple(line.split(", ")))
-                line = f.readline()
-    conn.commit()
-
-
-def fill_reviews(folder):
-    conn = create_connection(db)
-    counter = 0
-    for file in os.listdir(folder):
-        file = folder + "/" + file
-        with open(file) as f:
-            line = f.readline()
-            while line:
-                line = line.replace("\n", "")
-                print(counter)
-                counter += 1
-                insert_review(conn, tuple(line.split(", ")))
-                line = f.readline()
-    conn.commit()
-
-
-def unzip_fill_reviews(file):
-    conn = create_connection(db)
-    counter = 0
-    with zipfile.ZipFile(file) as z:
-        for filename in z.namelist():
-            if not os.path.isdir(filename):
-                # read the file
-                with z.open(filename) as f:
-                    for line in f:
-                        review = unicode_utils.byte_to_string(line)
-                        print(counter)
-                        counter += 1
-                        insert_review(conn, tuple(review.split(", ")))
-    conn.commit()
-
-
-# create_database()
-unzip_fill_reviews("../../data/reviews/reviews_aus_2.zip")
+def get_country(path):
+    # Country name of an archive/folder of one country, None when the path does not tell
+    match = country_pattern.search(os.path.basename(os.path.normpath(path)) + ".")
+    if match is None:
+        return None
+    return settings.COUNTRY_NAMES.get(match.group(1))
+
+
+def iter_files(path):
+    # Text streams of all csv files in a zip archive or a folder
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z:
+            for filename in z.namelist():
+                if not filename.endswith("/"):
+                    with z.open(filename) as f:
+                        yield io.TextIOWrapper(f, encoding="utf-8")
+    else:
+        for folder, folders, filenames in os.walk(path):
+            folders.sort()
+            for filename in sorted(filenames):
+                with open(os.path.join(folder, filename), encoding="utf-8") as f:
+                    yield f
+
+
+def iter_records(path, table, stats):
+    # Records of every csv line, columns are taken from the header of each file (older review files have no extra)
+    record = records[table]
+    for f in iter_files(path):
+        header = f.readline().rstrip("\n").split(", ")
+        for line in f:
+            values = line.rstrip("\n").split(", ")
+            if len(values) != len(header):
+                stats['skipped'] += 1
+                continue
+            fields = dict(zip(header, values))
+            if table == 'reviews':
+                fields.setdefault('extra', None)
+            yield record(**fields)
+
+
+def iter_rows(path, table, country, stats):
+    # Rows without id (database_schema.id_columns) are skipped
+    id_indexes = database_schema.get_id_indexes(table)
+    for record in iter_records(path, table, stats):
+        row = record.get_db_row(country) if table == 'provinces' else record.get_db_row()
+        if any(row[i] is None for i in id_indexes):
+            stats['skipped'] += 1
+            continue
+        yield row
+
+
+class BulkWriter(object):
+    # Rows of one table written with executemany in batches of batch_size rows. Every database file is loaded in
+    # one transaction without its indexes, which are created again on close.
+
+    def __init__(self, table, batch_size=10000):
+        self.sql = database_schema.get_insert_sql(table)
+        self.batch_size = batch_size
+        self.connections = {}
+        self.batches = {}
+        self.rows = 0
+
+    def open(self, db_file):
+        conn = sqlite3.connect(db_file, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA cache_size=-200000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        database_schema.create_database(conn)
+        database_schema.drop_indexes(conn)
+        conn.execute("BEGIN")
+        self.connections[db_file] = conn
+        self.batches[db_file] = []
+
+    def add(self, db_file, row):
+        if db_file not in self.connections:
+            self.open(db_file)
+        batch = self.batches[db_file]
+        batch.append(row)
+        self.rows += 1
+        if len(batch) >= self.batch_size:
+            self.write(db_file)
+
+    def write(self, db_file):
+        self.connections[db_file].executemany(self.sql, self.batches[db_file])
+        self.batches[db_file] = []
+
+    def close(self):
+        for db_file, conn in self.connections.items():
+            self.write(db_file)
+            conn.execute("COMMIT")
+            database_schema.create_indexes(conn)
+            conn.close()
+
+
+def bulk_load(table, paths, db_file=db, country=None, batch_size=10000, partitions=None, years=False):
+    # Loads all paths to db_file, or to the partitions of their countries in folder partitions (reviews of every
+    # year to their own partition with years). Returns number of loaded and skipped rows.
+    stats = {'rows': 0, 'skipped': 0}
+    writer = BulkWriter(table, batch_size)
+    partition_files = {}
+    start_time = time.time()
+    for path in paths:
+        path_start_time = time.time()
+        path_rows = writer.rows
+        path_country = country or get_country(path)
+        if partitions is not None and path_country is None:
+            raise ValueError("Country of %s is not known, use --country" % path)
+        for row in iter_rows(path, table, path_country, stats):
+            target = db_file
+            if partitions is not None:
+                year = database_partitions.get_review_year(row) if years and table == 'reviews' else None
+                if (path_country, year) not in partition_files:
+                    partition_files[(path_country, year)] = database_partitions.create_partition(
+                        path_country, year, partitions)
+                target = partition_files[(path_country, year)]
+            writer.add(target, row)
+        rows = writer.rows - path_rows
+        seconds = time.time() - path_start_time
+        print("%s: %s rows in %.1f s (%.0f rows/s)" % (path, rows, seconds, rows / max(seconds, 1e-6)))
+
+    index_start_time = time.time()
+    writer.close()
+    stats['rows'] = writer.rows
+    seconds = time.time() - start_time
+    print("Loaded %s %s (%s skipped) in %.1f s (%.0f rows/s), indexes took %.1f s" % (
+        stats['rows'], table, stats['skipped'], seconds, stats['rows'] / max(seconds, 1e-6),
+        time.time() - index_start_time))
+    return stats['rows'], stats['skipped']
+
+
+def bulk_load_partitioned(table, paths, partitions, country=None, batch_size=10000, years=False, jobs=1):
+    # Countries are loaded to their partitions by parallel processes (one writer per partition)
+    paths_by_country = {}
+    for path in paths:
+        path_country = country or get_country(path)
+        if path_country is None:
+            raise ValueError("Country of %s is not known, use --country" % path)
+        paths_by_country.setdefault(path_country, []).append(path)
+    tasks = [(table, country_paths, None, path_country, batch_size, partitions, years)
+             for path_country, country_paths in sorted(paths_by_country.items())]
+
+    start_time = time.time()
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.starmap(bulk_load, tasks)
+        pool.close()
+        pool.join()
+    else:
+        results = [bulk_load(*task) for task in tasks]
+    rows = sum(result[0] for result in results)
+    seconds = time.time() - start_time
+    print("Loaded %s %s to %s partitions in %.1f s (%.0f rows/s)" % (
+        rows, table, len(tasks), seconds, rows / max(seconds, 1e-6)))
+    return rows, sum(result[1] for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load scraped csv files (zip archives or folders)")
+    parser.add_argument("table", choices=["provinces", "locations", "reviews"])
+    parser.add_argument("paths", nargs="+", help="zip archives or folders with csv files")
+    parser.add_argument("--db", default=db)
+    parser.add_argument("--country", help="aus|cro|hun|ita|slo|ukr, taken from the archive name by default")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--partitioned", action="store_true", default=settings.DATABASE_PARTITIONED,
+                        help="load every country to its own database in --partitions")
+    parser.add_argument("--partitions", default=partitions)
+    parser.add_argument("--years", action="store_true", default=settings.DATABASE_PARTITION_YEARS,
+                        help="reviews of every year in their own partition")
+    parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(),
+                        help="countries loaded in parallel with --partitioned")
+    args = parser.parse_args()
+
+    country = settings.COUNTRY_NAMES.get(args.country, args.country)
+    if args.partitioned:
+        bulk_load_partitioned(args.table, args.paths, args.partitions, country, args.batch_size, args.years,
+                              args.jobs)
+    else:
+        bulk_load(args.table, args.paths, args.db, country, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
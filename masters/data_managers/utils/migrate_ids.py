@@ -0,0 +1,62 @@
+import sqlite3
+import sys
+
+sys.path.append("../../..")
+
+from masters.data_managers.utils import database_schema
+from masters.utils import type_utils
+from masters.utils import url_utils
+
+# Moves an existing database to integer ids: provinces are keyed by province_id (g<geo id> of province_url),
+# locations by location_id (d<detail id> of attraction_url) and reviews point to their location by location_id.
+# Rows without id (csv headers inserted as data, reviews without review_id) are dropped.
+#
+#     python migrate_ids.py ../../data/databases/data.db
+
+copy_sql = {
+    'provinces': """ INSERT OR REPLACE INTO provinces
+                     SELECT province_name, region_name, province_url, country, geo_id(province_url)
+                     FROM provinces_old WHERE geo_id(province_url) IS NOT NULL """,
+    'locations': """ INSERT OR REPLACE INTO locations
+                     SELECT attraction_name, attraction_rate, attraction_type, attraction_url, attraction_parent_url,
+                            location_id(attraction_url), geo_id(attraction_url), geo_id(attraction_parent_url)
+                     FROM locations_old WHERE location_id(attraction_url) IS NOT NULL """,
+    'reviews': """ INSERT OR REPLACE INTO reviews
+                   SELECT review_location_name, review_current_page, review_last_page, review_location_type,
+                          review_location_breadcrumbs, review_location_rate, location_lat, location_lng, to_int(review_id),
+                          review_date, review_experience_date, review_rate, user_name, user_link, user_id, extra,
+                          parent_url, location_id(parent_url)
+                   FROM reviews_old WHERE location_id(parent_url) IS NOT NULL AND to_int(review_id) IS NOT NULL """,
+}
+
+
+def has_column(conn, table, column):
+    return column in [row[1] for row in conn.execute("PRAGMA table_info(%s)" % table)]
+
+
+def migrate_ids(conn):
+    # Tables which already have their id column are left as they are, so migration can be repeated
+    conn.create_function("geo_id", 1, url_utils.get_geo_id)
+    conn.create_function("location_id", 1, url_utils.get_location_id)
+    conn.create_function("to_int", 1, type_utils.to_int)
+    id_columns = {'provinces': 'province_id', 'locations': 'location_id', 'reviews': 'location_id'}
+    for table in ('provinces', 'locations', 'reviews'):
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            continue
+        if has_column(conn, table, id_columns[table]):
+            continue
+        print("Migrating %s..." % table)
+        conn.execute("ALTER TABLE %s RENAME TO %s_old" % (table, table))
+        conn.execute(database_schema.tables[table])
+        conn.execute(copy_sql[table])
+        conn.execute("DROP TABLE %s_old" % table)
+        conn.commit()
+    database_schema.create_indexes(conn)
+    conn.commit()
+
+
+if __name__ == '__main__':
+    connection = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else "../../data/databases/data.db")
+    migrate_ids(connection)
+    connection.execute("VACUUM")
+    connection.close()
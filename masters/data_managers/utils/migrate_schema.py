@@ -0,0 +1,76 @@
+import sqlite3
+import sys
+import time
+
+sys.path.append("../../..")
+
+from masters.data_managers.utils import database_schema
+from masters.data_managers.utils import migrate_ids
+from masters.utils import type_utils
+
+# Moves an existing database to the current schema version (database_schema.version) in place:
+#   0 -> 1  tables keyed by integer ids (migrate_ids.py)
+#   1 -> 2  integer/real columns ("None" and non numeric values become NULL), reviews without review_id are dropped
+# Indexes of database_schema.indexes are created afterwards. Repeating the migration does nothing.
+#
+#     python migrate_schema.py ../../data/databases/data.db
+
+converters = {
+    'integer': 'to_int',
+    'real': 'to_float',
+    'text': 'to_text',
+}
+
+
+def get_column_types(conn, table):
+    return dict((row[1], row[2].lower()) for row in conn.execute("PRAGMA table_info(%s)" % table))
+
+
+def migrate_types(conn):
+    conn.create_function("to_int", 1, type_utils.to_int)
+    conn.create_function("to_float", 1, type_utils.to_float)
+    conn.create_function("to_text", 1, type_utils.to_text)
+    for table in ('provinces', 'locations', 'reviews'):
+        if not database_schema.has_table(conn, table):
+            continue
+        print("Migrating %s..." % table)
+        conn.execute("ALTER TABLE %s RENAME TO %s_old" % (table, table))
+        conn.execute(database_schema.tables[table])
+        column_types = get_column_types(conn, table)
+        old_columns = get_column_types(conn, "%s_old" % table)
+        values = ["%s(%s)" % (converters[column_types[column]], column) if column in old_columns else "NULL"
+                  for column in database_schema.columns[table]]
+        conditions = ["%s IS NOT NULL" % value for column, value in zip(database_schema.columns[table], values)
+                      if column in database_schema.id_columns[table]]
+        conn.execute("INSERT OR REPLACE INTO %s(%s) SELECT %s FROM %s_old WHERE %s" % (
+            table, ", ".join(database_schema.columns[table]), ", ".join(values), table, " AND ".join(conditions)))
+        conn.execute("DROP TABLE %s_old" % table)
+        conn.commit()
+
+
+migrations = {
+    1: migrate_ids.migrate_ids,
+    2: migrate_types,
+}
+
+
+def migrate_schema(conn):
+    schema_version = database_schema.get_version(conn)
+    while schema_version < database_schema.version:
+        schema_version += 1
+        start_time = time.time()
+        print("Migrating to version %s..." % schema_version)
+        migrations[schema_version](conn)
+        database_schema.set_version(conn, schema_version)
+        conn.commit()
+        print("Version %s in %.1f s" % (schema_version, time.time() - start_time))
+    database_schema.create_indexes(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+if __name__ == '__main__':
+    connection = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else "../../data/databases/data.db")
+    migrate_schema(connection)
+    connection.execute("VACUUM")
+    connection.close()
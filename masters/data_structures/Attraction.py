@@ -1,18 +1,39 @@
+from masters.utils import url_utils
+from masters.utils.type_utils import to_float, to_text
+
+
 class Attraction(object):
+    # Typed record, rate is a float and missing values are None. Values are escaped only when written to csv.
+    __slots__ = ('attraction_url', 'attraction_name', 'attraction_type', 'attraction_rate', 'attraction_parent_url',
+                 'location_id', 'geo_id', 'province_id')
+
     def __init__(self, attraction_name, attraction_rate, attraction_type, attraction_url, attraction_parent_url):
-        self.attraction_url = self.clean_value(attraction_url)
-        self.attraction_name = self.clean_value(attraction_name)
-        self.attraction_type = self.clean_value(attraction_type)
-        self.attraction_rate = self.clean_value(attraction_rate)
-        self.attraction_parent_url = self.clean_value(attraction_parent_url)
+        self.attraction_url = to_text(attraction_url)
+        self.attraction_name = to_text(attraction_name)
+        self.attraction_type = to_text(attraction_type)
+        self.attraction_rate = to_float(attraction_rate)
+        self.attraction_parent_url = to_text(attraction_parent_url)
+        self.location_id = url_utils.get_location_id(attraction_url)
+        self.geo_id = url_utils.get_geo_id(attraction_url)
+        self.province_id = url_utils.get_geo_id(attraction_parent_url)
 
     def get_csv_line(self):
         return "{}, {}, {}, {}, {}\n".format(
-            self.attraction_name,
+            self.clean_value(self.attraction_name),
             self.attraction_rate,
-            self.attraction_type,
-            self.attraction_url,
-            self.attraction_parent_url)
+            self.clean_value(self.attraction_type),
+            self.clean_value(self.attraction_url),
+            self.clean_value(self.attraction_parent_url))
+
+    def get_db_row(self):
+        # Values in the order of the locations table columns
+        return (self.attraction_name, self.attraction_rate, self.attraction_type, self.attraction_url,
+                self.attraction_parent_url, self.location_id, self.geo_id, self.province_id)
+
+    @classmethod
+    def from_db_row(cls, row):
+        # Attraction of a row of the locations table (get_db_row)
+        return cls(*row[:5])
 
     @staticmethod
     def clean_value(value):
@@ -1,6 +1,12 @@
+from masters.utils import url_utils
+
+
 class AttractionInfomap(object):
+    __slots__ = ('attraction_url', 'attraction_name', 'number', 'location_id')
+
     def __init__(self, attraction_name,
                  attraction_url, number):
         self.attraction_url = attraction_url
         self.attraction_name = attraction_name
         self.number = number
+        self.location_id = url_utils.get_location_id(attraction_url)
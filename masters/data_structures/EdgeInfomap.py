@@ -1,4 +1,6 @@
 class EdgeInfomap(object):
+    __slots__ = ('weight', 'review_from', 'review_to')
+
     def __init__(self,
                  weight,
                  review_from,
@@ -1,20 +1,35 @@
+from masters.utils import url_utils
+from masters.utils.type_utils import to_text
+
+
 class Province(object):
     # Province(obcina) URL example: https://www.tripadvisor.com/Attractions-g187768-Activities-oa20-Italy.html
+    __slots__ = ('province_name', 'region_name', 'province_url', 'province_id')
 
     def __init__(self, province_name,
                  region_name,
                  province_url):
-        self.province_name = self.clean_value(province_name)
-        self.region_name = self.clean_value(region_name)
-        self.province_url = self.clean_value(province_url)
+        self.province_name = to_text(province_name)
+        self.region_name = to_text(region_name)
+        self.province_url = to_text(province_url)
+        self.province_id = url_utils.get_geo_id(province_url)
 
     def get_csv_line(self):
         return "{}, {}, {}\n".format(
-            self.province_name,
-            self.region_name,
-            self.province_url
+            self.clean_value(self.province_name),
+            self.clean_value(self.region_name),
+            self.clean_value(self.province_url)
         )
 
+    def get_db_row(self, country):
+        # Values in the order of the provinces table columns
+        return self.province_name, self.region_name, self.province_url, country, self.province_id
+
+    @classmethod
+    def from_db_row(cls, row):
+        # Province of a row of the provinces table (get_db_row), country is not kept
+        return cls(*row[:3])
+
     @staticmethod
     def get_csv_header():
         return "province_name, " \
@@ -1,4 +1,15 @@
+from masters.utils import url_utils
+from masters.utils.type_utils import to_int, to_float, to_text
+
+
 class Review(object):
+    # Typed record: dates (yyyymmdd), pages and ids are ints, rates and coordinates floats, missing values None.
+    # Values are escaped only when they are written to csv.
+    __slots__ = ('review_location_name', 'review_current_page', 'review_last_page', 'review_location_type',
+                 'review_location_breadcrumbs', 'review_location_rate', 'location_lat', 'location_lng', 'review_id',
+                 'review_date', 'review_experience', 'review_rate', 'user_name', 'user_link', 'user_id', 'extra',
+                 'parent_url', 'location_id')
+
     def __init__(self,
                  review_location_name,
                  review_current_page,
@@ -18,31 +29,35 @@ class Review(object):
                  extra,
                  parent_url
                  ):
-        self.review_location_name = self.clean_value(review_location_name)
-        self.review_current_page = self.clean_value(review_current_page)
-        self.review_last_page = self.clean_value(review_last_page)
-        self.review_location_type = self.clean_value(review_location_type)
-        self.review_location_breadcrumbs = self.clean_value(review_location_breadcrumbs)
-        self.review_location_rate = self.clean_value(review_location_rate)
-        self.location_lat = self.clean_value(location_lat)
-        self.location_lng = self.clean_value(location_lng)
-        self.review_id = self.clean_value(review_id)
-        self.review_date = self.clean_value(review_date)
-        self.review_experience = self.clean_value(review_experience_date)
-        self.review_rate = self.clean_value(review_rate)
-        self.user_name = self.clean_value(user_name)
-        self.user_link = self.clean_value(user_link)
-        self.user_id = self.clean_value(user_id)
-        self.extra = self.clean_value(extra)
-        self.parent_url = self.clean_value(parent_url)
+        self.review_location_name = to_text(review_location_name)
+        self.review_current_page = to_int(review_current_page)
+        self.review_last_page = to_int(review_last_page)
+        self.review_location_type = to_text(review_location_type)
+        self.review_location_breadcrumbs = to_text(review_location_breadcrumbs)
+        self.review_location_rate = to_float(review_location_rate)
+        self.location_lat = to_float(location_lat)
+        self.location_lng = to_float(location_lng)
+        self.review_id = to_int(review_id)
+        self.review_date = to_int(review_date)
+        self.review_experience = to_int(review_experience_date)
+        self.review_rate = to_float(review_rate)
+        self.user_name = to_text(user_name)
+        self.user_link = to_text(user_link)
+        self.user_id = to_text(user_id)
+        self.extra = to_text(extra)
+        self.parent_url = to_text(parent_url)
+        self.location_id = url_utils.get_location_id(parent_url)
+        if self.review_id is None and self.review_date is None and self.user_link is None:
+            # Row of a location without reviews keeps its coordinates and details under an id of its own
+            self.review_id = self.get_placeholder_id(self.location_id)
 
     def get_csv_line(self):
         return "{}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}\n".format(
-            self.review_location_name,
+            self.clean_value(self.review_location_name),
             self.review_current_page,
             self.review_last_page,
-            self.review_location_type,
-            self.review_location_breadcrumbs,
+            self.clean_value(self.review_location_type),
+            self.clean_value(self.review_location_breadcrumbs),
             self.review_location_rate,
             self.location_lat,
             self.location_lng,
@@ -50,13 +65,42 @@ class Review(object):
             self.review_date,
             self.review_experience,
             self.review_rate,
-            self.user_name,
-            self.user_link,
-            self.user_id,
-            self.extra,
-            self.parent_url
+            self.clean_value(self.user_name),
+            self.clean_value(self.user_link),
+            self.clean_value(self.user_id),
+            self.clean_value(self.extra),
+            self.clean_value(self.parent_url)
         )
 
+    def get_db_row(self):
+        # Values in the order of the reviews table columns
+        return (self.review_location_name, self.review_current_page, self.review_last_page, self.review_location_type,
+                self.review_location_breadcrumbs, self.review_location_rate, self.location_lat, self.location_lng,
+                self.review_id, self.review_date, self.review_experience, self.review_rate, self.user_name,
+                self.user_link, self.user_id, self.extra, self.parent_url, self.location_id)
+
+    @staticmethod
+    def get_placeholder_id(location_id):
+        # Negative location id, review ids are positive
+        if location_id is None:
+            return None
+        return -location_id
+
+    @classmethod
+    def from_db_row(cls, row):
+        # Review of a row of the reviews table (get_db_row)
+        return cls(*row[:17])
+
+    @staticmethod
+    def only_known(reviews, known_ids):
+        # True when every review of a page is already in known_ids (incremental refresh can stop)
+        if known_ids is None or not reviews:
+            return False
+        for review in reviews:
+            if review.review_id not in known_ids:
+                return False
+        return True
+
     @staticmethod
     def clean_value(value):
         return str(value).replace(",", "&&").replace("\"", "'")
@@ -1,4 +1,12 @@
+from masters.utils import url_utils
+from masters.utils.type_utils import to_int, to_float, to_text
+
+
 class ReviewInfomap(object):
+    # Typed record as Review: review_date (yyyymmdd) and review_id are ints, rates and coordinates floats
+    __slots__ = ('review_rate', 'place_rate', 'user_id', 'review_date', 'review_id', 'lng', 'lat', 'location_tags',
+                 'location_name', 'username', 'parent_url', 'country_of_origin', 'attraction', 'location_id')
+
     def __init__(self, location_name,
                  location_tags,
                  lat,
@@ -12,16 +20,17 @@ class ReviewInfomap(object):
                  parent_url,
                  country_of_origin,
                  attraction):
-        self.review_rate = review_rate
-        self.place_rate = place_rate
-        self.user_id = user_id
+        self.review_rate = to_float(review_rate)
+        self.place_rate = to_float(place_rate)
+        self.user_id = to_text(user_id)
         self.review_date = int(review_date)
-        self.review_id = review_id
-        self.lng = lng
-        self.lat = lat
-        self.location_tags = location_tags
-        self.location_name = location_name
-        self.username = username
+        self.review_id = to_int(review_id)
+        self.lng = to_float(lng)
+        self.lat = to_float(lat)
+        self.location_tags = to_text(location_tags)
+        self.location_name = to_text(location_name)
+        self.username = to_text(username)
         self.parent_url = parent_url
-        self.country_of_origin = country_of_origin
+        self.country_of_origin = to_text(country_of_origin)
         self.attraction = attraction
+        self.location_id = url_utils.get_location_id(parent_url)
@@ -0,0 +1,22 @@
+class WorkUnit(object):
+    # Review pages [start_page, end_page) of one location, end_page None means up to the last page
+    # (expected_pages is then the estimate of how many pages that is)
+    def __init__(self, parent_url, start_page=1, end_page=None, expected_pages=1):
+        self.parent_url = parent_url
+        self.start_page = start_page
+        self.end_page = end_page
+        self.expected_pages = expected_pages
+
+    def get_cost(self):
+        if self.end_page is None:
+            return self.expected_pages
+        return self.end_page - self.start_page
+
+    def is_whole_location(self):
+        return self.start_page == 1 and self.end_page is None
+
+    def get_key(self):
+        return "%s#%s-%s" % (self.parent_url, self.start_page, self.end_page)
+
+    def __repr__(self):
+        return self.get_key()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+# Duplicate request filter for all spiders
+#
+# Requests are compared by fingerprints of their canonical urls, so a page linked with and without #REVIEWS or
+# through tripadvisor.co.uk and tripadvisor.com is requested once. Fingerprints of downloaded pages are kept in
+# FINGERPRINT_FILTER_FILE (shared with the gecko workers), so pages downloaded before a restart are not requested
+# again. Pages are added to the file by DatabasePipeline once their rows are committed (FetchedPageMiddleware).
+# Spiders which have to see every page set skip_fetched_pages = False. Retries need dont_filter=True.
+# Http cache replays (HTTPCACHE_MODE = "replay") don't use the file, every recorded page is replayed.
+
+from scrapy.dupefilters import BaseDupeFilter
+
+from masters import httpcache
+from masters.managers import fingerprint_manager
+
+
+class FingerprintDupeFilter(BaseDupeFilter):
+    def __init__(self, crawler=None, debug=False):
+        self.crawler = crawler
+        self.debug = debug
+        # Requests scheduled in this run
+        self.scheduled = fingerprint_manager.BloomFilter()
+        # Pages downloaded in any run
+        self.fetched = fingerprint_manager.get_fingerprints()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if httpcache.is_replay(crawler.settings):
+            fingerprint_manager.disable()
+        return cls(crawler, crawler.settings.getbool('DUPEFILTER_DEBUG'))
+
+    def skip_fetched_pages(self):
+        spider = getattr(self.crawler, 'spider', None)
+        return self.fetched is not None and getattr(spider, 'skip_fetched_pages', True)
+
+    def request_seen(self, request):
+        fingerprint = fingerprint_manager.get_fingerprint(request.url, request.method, request.body)
+        if self.skip_fetched_pages() and self.fetched.contains(fingerprint):
+            return True
+        return not self.scheduled.add(fingerprint)
+
+    def close(self, reason):
+        if self.fetched is not None:
+            self.fetched.flush()
+
+    def log(self, request, spider):
+        if self.debug:
+            spider.logger.debug("Filtered duplicate request: %s" % request)
@@ -1,27 +1,20 @@
-import time
 import sys
 
 sys.path.append("..")
 import masters
 from masters.gecko_spiders.reviews_gecko import GeckoReviewSpider
+from masters.gecko_spiders.gecko_pool import scrap_location, get_known_review_ids
+from masters.data_managers.utils import database_partitions
 
+# python3 gecko_runner.py <location_url> [start_page] [end_page]
 domain = "https://www.tripadvisor.com"
-start_time = time.time()
 parent_url = sys.argv[1]
-site = GeckoReviewSpider(domain + parent_url)
-site.select_all_languages()
-scraped_pages = 0
-
-if site.is_other_page():
-    site.stop_spider()
-    exit(0)
-if site.is_not_ram_capable(parent_url):
-    site.stop_spider()
-    exit(1)
-while site.has_next_review_page():
-    site.scrap_page(parent_url, scraped_pages, start_time, domain)
-    scraped_pages += 1
-    site.next_page()
-site.scrap_page(parent_url, scraped_pages, start_time, domain)
+start_page = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+end_page = int(sys.argv[3]) if len(sys.argv) > 3 else None
+site = GeckoReviewSpider()
+sink = database_partitions.create_sink()
+status, pages = scrap_location(site, parent_url, domain, get_known_review_ids(parent_url), start_page, end_page,
+                               sink=sink)
+sink.close()
 site.stop_spider()
-
+exit(status)
@@ -0,0 +1,262 @@
+import threading
+import time
+
+from masters import settings
+from masters.gecko_spiders.reviews_gecko import GeckoReviewSpider
+from masters.data_managers.utils import database_utils
+from masters.data_managers.utils import database_partitions
+from masters.data_structures.Review import Review
+from masters.data_structures.WorkUnit import WorkUnit
+from masters.managers import schedule_manager
+from masters.managers import fingerprint_manager
+from masters.managers import shard_manager
+from masters.managers import work_queue_manager
+from masters.utils import url_utils
+from masters.utils.logger_utils import Logger
+from masters.managers import crawl_state_manager
+
+
+def get_known_review_ids(parent_url):
+    # Review ids already in the database, None when incremental refresh is off
+    if not settings.REVIEWS_INCREMENTAL:
+        return None
+    return database_utils.load_known_review_ids(parent_url, [settings.COUNTRY])
+
+
+def scrap_location(site, parent_url, domain, known_ids=None, start_page=1, end_page=None, split=None, sink=None):
+    # Scraps review pages [start_page, end_page) of one location (all pages when end_page is None)
+    # with an already running spider.
+    # Returns exit status as gecko_runner.py (0 - success, 1 - location should be retried) and scraped pages.
+    # With known_ids scraping stops at the first page which has only known reviews (reviews are newest first).
+    # split(last_page) is called after the first page and returns new end_page, pages after it are scraped elsewhere.
+    # Reviews are written to sink (DatabaseSink or PartitionedSink) when given.
+    start_time = time.time()
+    if not site.open_location(domain + parent_url):
+        return 1, 0
+    site.select_all_languages()
+    scraped_pages = 0
+
+    if site.is_other_page():
+        return 0, 0
+    page = start_page
+    if page > 1 and not site.goto_page(parent_url, domain, page):
+        return 1, 0
+    while True:
+        reviews = site.scrap_page(parent_url, scraped_pages, start_time, domain)
+        if reviews is None:
+            return 1, scraped_pages
+        if sink is not None:
+            sink.add_reviews(reviews)
+        scraped_pages += 1
+        site.pages_since_start += 1
+        if Review.only_known(reviews, known_ids):
+            Logger.log_it("Only known reviews on page %s, location is up to date" % page)
+            return 0, scraped_pages
+
+        if site.current_page is not None:
+            page = site.current_page
+        page_url = domain + url_utils.get_review_page_url(parent_url, page)
+        if sink is not None:
+            sink.mark_fetched(fingerprint_manager.get_fingerprint(page_url))
+        else:
+            fingerprint_manager.mark_fetched(page_url)
+        if split is not None and site.last_page is not None:
+            end_page = split(max(site.last_page, page))
+            split = None
+        last_page = site.last_page
+        if end_page is not None and last_page is not None:
+            last_page = min(last_page, end_page - 1)
+        if last_page is None or page >= last_page:
+            break
+        page += 1
+        # Pages downloaded before a restart are skipped, unless reviews are refreshed (they moved to later pages)
+        if known_ids is None and settings.GECKO_URL_NAVIGATION:
+            while page <= last_page and fingerprint_manager.is_fetched(
+                    domain + url_utils.get_review_page_url(parent_url, page)):
+                page += 1
+                scraped_pages += 1
+            if page > last_page:
+                break
+
+        # Big locations don't fit into one browser's memory, restart it and continue at the next page
+        if site.needs_recycle():
+            navigated = site.resume_location(parent_url, domain, page)
+        elif settings.GECKO_URL_NAVIGATION:
+            navigated = site.goto_page(parent_url, domain, page)
+        else:
+            site.next_page()
+            navigated = True
+        if not navigated:
+            return 1, scraped_pages
+    return 0, scraped_pages
+
+
+class GeckoWorker(threading.Thread):
+    # Keeps one browser warm and scraps work units leased from the pool's queue until the queue is drained
+
+    def __init__(self, pool, number):
+        super(GeckoWorker, self).__init__(name="gecko-worker-%s" % number)
+        self.daemon = True
+        self.pool = pool
+        self.owner = work_queue_manager.get_owner(self.name)
+        self.unit = None
+        self.site = None
+
+    def run(self):
+        try:
+            self.scrap_units()
+        except Exception as e:
+            # Leases of the worker are given back by the pool (release_dead_workers)
+            Logger.log_it("Worker %s stopped: %s" % (self.name, str(e)))
+        finally:
+            self.unit = None
+            if self.site is not None:
+                try:
+                    self.site.stop_spider()
+                except Exception as e:
+                    Logger.log_it("Worker %s could not stop browser: %s" % (self.name, str(e)))
+
+    def scrap_units(self):
+        while True:
+            unit = self.pool.queue.lease(self.owner)
+            self.pool.report_finished()
+            if unit is None:
+                # Units being scraped can still be split or (on other nodes) expire and come back
+                self.pool.release_dead_workers()
+                if self.pool.queue.is_drained():
+                    break
+                time.sleep(settings.WORK_QUEUE_POLL)
+                continue
+            self.unit = unit
+            status, pages = 1, 0
+            try:
+                if self.site is None:
+                    self.site = GeckoReviewSpider()
+                known_ids = get_known_review_ids(unit.parent_url)
+                split = None
+                if unit.is_whole_location() and known_ids is None and settings.GECKO_SHARD_PAGES > 0:
+                    split = lambda last_page: self.pool.split(unit.parent_url, last_page)
+                status, pages = scrap_location(self.site, unit.parent_url, self.pool.domain, known_ids,
+                                               unit.start_page, unit.end_page, split, self.pool.sink)
+            except Exception as e:
+                Logger.log_it("Worker %s failed on %s: %s" % (self.name, unit, str(e)))
+                self.restart_browser()
+            finally:
+                # Lease is given back whatever happened, otherwise the queue is never drained
+                self.unit = None
+                self.pool.unit_done(unit, self.owner, status, pages)
+            if self.site is not None and self.site.needs_recycle():
+                self.restart_browser()
+
+    def restart_browser(self):
+        # Firefox or geckodriver which does not start doesn't stop the worker, next unit starts a fresh browser
+        if self.site is None:
+            return
+        try:
+            self.site.restart_browser()
+        except Exception as e:
+            Logger.log_it("Worker %s could not restart browser: %s" % (self.name, str(e)))
+            self.site = None
+
+
+class GeckoWorkerPool(object):
+    def __init__(self, workers=settings.GECKO_WORKERS, domain="https://www.tripadvisor.com", queue=None):
+        self.domain = domain
+        # Longest job first, units with the most (expected) pages are leased first
+        self.queue = queue if queue is not None else work_queue_manager.get_work_queue()
+        # One database connection for all workers, reviews are written in batches
+        self.sink = database_partitions.create_sink()
+        self.workers = [GeckoWorker(self, i) for i in range(workers)]
+        self.lock = threading.Lock()
+        self.total = 0
+        self.done = 0
+        self.expected_pages = {}
+        self.eta = schedule_manager.PageEta()
+        self.stopped = threading.Event()
+        self.heartbeat = threading.Thread(target=self.send_heartbeats, name="gecko-heartbeat")
+        self.heartbeat.daemon = True
+
+    def start(self):
+        self.eta.start()
+        for worker in self.workers:
+            worker.start()
+        self.heartbeat.start()
+
+    def send_heartbeats(self):
+        # Extends leases of units which are being scraped, so other nodes don't take them over
+        while not self.stopped.wait(settings.WORK_QUEUE_LEASE / 3.0):
+            for worker in self.workers:
+                unit = worker.unit
+                if unit is not None and not self.queue.heartbeat(worker.owner, unit):
+                    Logger.log_it("Worker %s lost lease of %s" % (worker.name, unit))
+
+    def add_location(self, parent_url, expected_pages=settings.SCHEDULE_DEFAULT_PAGES):
+        # Location which is already in a shared queue is not added (and counted) again
+        if not self.queue.put(WorkUnit(parent_url, expected_pages=expected_pages)):
+            return False
+        with self.lock:
+            self.total += 1
+            self.expected_pages[parent_url] = expected_pages
+        self.eta.add(expected_pages)
+        return True
+
+    def correct_expected_pages(self, parent_url, pages):
+        with self.lock:
+            delta = pages - self.expected_pages.get(parent_url, 0)
+            self.expected_pages[parent_url] = pages
+        self.eta.add(delta)
+
+    def split(self, parent_url, last_page):
+        # Called by the worker which scraped the first page of a location. It keeps the first
+        # GECKO_SHARD_PAGES pages, the rest is handed out to other workers as independent units.
+        self.correct_expected_pages(parent_url, last_page)
+        shard_pages = settings.GECKO_SHARD_PAGES
+        if last_page <= shard_pages:
+            return None
+        units = shard_manager.split_location(parent_url, shard_pages + 1, last_page, shard_pages)
+        Logger.log_it("Splitting %s (%s pages) into %s shards" % (parent_url, last_page, len(units) + 1))
+        for unit in units:
+            self.queue.put(unit)
+        return shard_pages + 1
+
+    def unit_done(self, unit, owner, status, pages):
+        self.eta.done(pages)
+        result = self.queue.complete(unit, owner, status, pages)
+        if result is not None:
+            self.location_done(unit.parent_url, result[0], result[1])
+
+    def report_finished(self):
+        # Locations whose last unit failed because its lease expired (shared queue)
+        for parent_url, status, pages in self.queue.get_finished():
+            Logger.log_it("Lease of the last unit of %s expired too often" % parent_url)
+            self.location_done(parent_url, status, pages)
+
+    def release_dead_workers(self):
+        # Units leased by workers which died are failed attempts, so they are retried or their location fails
+        for worker in self.workers:
+            if worker.ident is None or worker.is_alive():
+                continue
+            for unit in self.queue.get_leased(worker.owner):
+                Logger.log_it("Worker %s died on %s" % (worker.name, unit))
+                self.unit_done(unit, worker.owner, 1, 0)
+
+    def location_done(self, parent_url, status, pages):
+        if status == 0:
+            Logger.log_location(parent_url)
+            crawl_state_manager.mark_done(parent_url, pages)
+        else:
+            crawl_state_manager.mark_failed(parent_url)
+        # Location stopped early (failure, only known reviews) or had no estimate, scraped pages are the truth now
+        self.correct_expected_pages(parent_url, pages)
+        with self.lock:
+            self.done += 1
+            Logger.log_it('Locations: %s/%s | %s' % (self.done, self.total, self.eta.get_text()))
+
+    def join(self):
+        # Waits until the queue is drained and the browsers are shut down
+        for worker in self.workers:
+            worker.join()
+        self.release_dead_workers()
+        self.stopped.set()
+        self.queue.close()
+        self.sink.close()
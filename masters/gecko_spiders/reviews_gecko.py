@@ -3,16 +3,80 @@ import time
 import json
 
 from selenium import webdriver
-from selenium.common.exceptions import WebDriverException, StaleElementReferenceException, NoSuchElementException
+from selenium.common.exceptions import WebDriverException, StaleElementReferenceException, NoSuchElementException, \
+    TimeoutException
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
 
 from masters import settings
 from masters.data_structures.Review import Review
-from masters.utils import unicode_utils, coordinate_utils, file_utils
+from masters.utils import unicode_utils, coordinate_utils, process_utils, url_utils
 from masters.utils.logger_utils import Logger
 from masters.utils.timer_utils import Timer
 
+# Returns all fields of a review page which are needed to build Review objects
+PAGE_SNAPSHOT_SCRIPT = """
+    var text = function (root, selector) {
+        var element = root.querySelector(selector);
+        return element === null ? null : element.innerText.trim();
+    };
+    var texts = function (root, selector) {
+        return Array.prototype.map.call(root.querySelectorAll(selector), function (element) {
+            return element.innerText.trim();
+        });
+    };
+    var attribute = function (root, selector, name) {
+        var element = root.querySelector(selector);
+        return element === null ? null : element.getAttribute(name);
+    };
+    var snapshot = {
+        url: window.location.href,
+        location_name: text(document, 'div h1.ui_header'),
+        current_page: text(document, 'div.pageNumbers span.current'),
+        pages: texts(document, 'div.pageNumbers a.pageNum'),
+        location_types: texts(document, 'div._3RTCF0T0 a._1cn4vjE4'),
+        breadcrumbs: texts(document, 'div ul.breadcrumbs li.breadcrumb a span'),
+        location_rate: attribute(document, 'div._1NKYRldB span.ui_bubble_rating', 'class'),
+        all_languages: document.getElementById('filters_detail_language_filterLang_ALL') === null ? null :
+            document.getElementById('filters_detail_language_filterLang_ALL').checked,
+        history: null,
+        grades: [],
+        reviews: []
+    };
+    var scripts = document.getElementsByTagName('script');
+    for (var i = 0; i < scripts.length; i++) {
+        var content = scripts[i].textContent;
+        if (content.indexOf("recentHistoryList") !== -1 && content.indexOf("coords") !== -1) {
+            snapshot.history = content;
+            break;
+        }
+    }
+    var grades = document.querySelectorAll('div.ui_column ul._2lcHrbTn li.ui_checkbox._3gEj_Jb5');
+    for (var j = 0; j < grades.length; j++) {
+        var value = text(grades[j], 'span._3fVK8yi6');
+        if (value === null) {
+            break;
+        }
+        snapshot.grades.push([text(grades[j], 'label'), value]);
+    }
+    var reviews = document.querySelectorAll('div.main_content div.Dq9MAugU');
+    for (var k = 0; k < reviews.length; k++) {
+        var user = reviews[k].querySelector('a.ui_header_link');
+        snapshot.reviews.push({
+            id: attribute(reviews[k], 'div.oETBfkHU', 'data-reviewid'),
+            date: text(reviews[k], 'div._2fxQ4TOx span'),
+            experience: text(reviews[k], 'div._27JpaCjl span'),
+            rate: attribute(reviews[k], 'span.ui_bubble_rating', 'class'),
+            user_name: user === null ? null : user.innerText.trim(),
+            user_link: user === null ? null : user.href
+        });
+    }
+    return snapshot;
+"""
+
 
 def exception_handler(f):
     def wrapper(*args, **kwargs):
@@ -40,17 +104,34 @@ def stale_decorator(f):
             except WebDriverException:
                 Logger.log_it("Web driver exception... retrying")
                 counter -= 1
-            time.sleep(1)
+            args[0].wait_for_page_ready()
         return None
 
     return wrapper
 
 
 class GeckoReviewSpider(object):
-    def __init__(self, url):
+    def __init__(self, url=None):
         Logger.log_it("##########################################")
         self.timer = Timer()
         self.timer.start_timer()
+        self.driver = None
+        self.pages_since_start = 0
+        # Pagination of the last scraped page (None when location has one page)
+        self.current_page = None
+        self.last_page = None
+        # Seconds spent waiting for the page since the last scraped page, and per scraped page
+        self.page_wait = 0
+        self.wait_times = []
+        self.start_browser()
+
+        if url is not None and not self.open_location(url):
+            self.driver.close()
+            return
+        # self.driver.implicitly_wait(0.5)
+        # self.wait = WebDriverWait(self.driver, 5)
+
+    def start_browser(self):
         options = Options()
         options.headless = settings.HEADLESS_MODE
 
@@ -68,27 +149,111 @@ class GeckoReviewSpider(object):
 
         # self.driver = gecko_utils.get_gecko_driver()
         self.driver = webdriver.Firefox(options=options, firefox_profile=firefox_profile)
+        self.pages_since_start = 0
 
+    def restart_browser(self):
+        Logger.log_it("Restarting browser after %s pages" % self.pages_since_start)
+        try:
+            self.driver.quit()
+        except Exception as e:
+            Logger.log_it("Browser did not quit cleanly: " + str(e))
+        self.start_browser()
+
+    def open_location(self, url):
         # driver.add_cookie({'name': 'TALanguage', 'value': 'ALL'})
         try:
             self.driver.get(url)
-        except:
-            self.driver.close()
-            return
-        # self.driver.implicitly_wait(0.5)
-        # self.wait = WebDriverWait(self.driver, 5)
+            return True
+        except Exception as e:
+            Logger.log_it("Failed to open " + url + ": " + str(e))
+            return False
+
+    def goto_page(self, parent_url, root_url, page):
+        # Opens review page (1 based) of the location directly by its -Reviews-orNNN- url
+        Logger.log_it("Opening page %s" % page)
+        return self.open_location(root_url + url_utils.get_review_page_url(parent_url, page))
+
+    def resume_location(self, parent_url, root_url, page):
+        # Continues a location at page in a fresh browser. Language filter is selected
+        # on the first page and then the url of the page is opened.
+        self.restart_browser()
+        if not self.open_location(root_url + parent_url):
+            return False
+        self.select_all_languages()
+        Logger.log_it("Resuming %s at page %s" % (parent_url, page))
+        return self.goto_page(parent_url, root_url, page)
+
+    def browser_memory(self):
+        # Resident memory (MB) of firefox and all of its content processes
+        try:
+            pid = self.driver.capabilities['moz:processID']
+        except Exception:
+            return 0
+        return process_utils.get_process_tree_rss(pid)
+
+    def needs_recycle(self):
+        if self.pages_since_start >= settings.GECKO_RECYCLE_PAGES:
+            return True
+        memory = self.browser_memory()
+        if memory >= settings.GECKO_RECYCLE_MEMORY:
+            Logger.log_it("Browser uses %s MB of memory" % memory)
+            return True
+        return False
+
+    def wait_for(self, condition, name, timeout=settings.GECKO_WAIT_TIMEOUT):
+        start = time.time()
+        try:
+            WebDriverWait(self.driver, timeout, poll_frequency=settings.GECKO_WAIT_POLL).until(condition)
+            result = True
+        except TimeoutException:
+            Logger.log_it("Timeout while waiting for " + name)
+            result = False
+        self.page_wait += time.time() - start
+        return result
+
+    def wait_for_page_ready(self):
+        return self.wait_for(lambda driver: driver.execute_script("return document.readyState") == "complete",
+                             "page ready")
+
+    def get_first_review(self):
+        try:
+            return self.driver.find_element_by_css_selector('div.main_content div.Dq9MAugU')
+        except NoSuchElementException:
+            return None
+
+    def get_current_page_number(self):
+        try:
+            return self.driver.find_element_by_css_selector('div.pageNumbers span.pageNum.current').text
+        except (NoSuchElementException, StaleElementReferenceException):
+            return None
+
+    def wait_for_reviews_reload(self, first_review):
+        # Reviews are replaced by javascript, old review element goes stale once new ones are rendered
+        if first_review is not None:
+            self.wait_for(expected_conditions.staleness_of(first_review), "reviews reload")
+
+    def record_page_wait(self):
+        Logger.log_it("Waited %.3f seconds for page" % self.page_wait)
+        self.wait_times.append(self.page_wait)
+        self.page_wait = 0
 
     @exception_handler
     def select_all_languages(self):
-        time.sleep(1)
         Logger.log_it("Selecting all languages")
+        self.wait_for(expected_conditions.presence_of_element_located((By.CSS_SELECTOR, "h2._1VLgXtcm")),
+                      "review title")
         review_title = self.driver.find_element_by_css_selector("h2._1VLgXtcm")
         y = review_title.location['y']
         self.driver.execute_script("window.scrollTo(0, " + str(y) + ");")
-        time.sleep(0.2)
+        self.wait_for(expected_conditions.element_to_be_clickable((By.CSS_SELECTOR, 'label.bUKZfPPw')),
+                      "all languages filter")
         all_languages = self.driver.find_element_by_css_selector('label.bUKZfPPw')
+        first_review = self.get_first_review()
         ActionChains(self.driver).move_to_element(all_languages).click().perform()
-        time.sleep(1)
+        self.wait_for(lambda driver: self.is_all_languages_selected(), "all languages checked")
+        self.wait_for_reviews_reload(first_review)
+        # Keeps the filter for pages opened by url
+        self.driver.add_cookie({'name': 'TALanguage', 'value': 'ALL'})
 
     @stale_decorator
     def is_all_languages_selected(self):
@@ -105,24 +270,6 @@ class GeckoReviewSpider(object):
             Logger.log_it("It is not. Scraping.")
             return False
 
-    def is_not_ram_capable(self, parent_url):
-        Logger.log_it("Checking if machine is RAM capable")
-        try:
-            review_last_page = self.driver.find_elements_by_css_selector('div.pageNumbers a.pageNum')[-1].text
-        except Exception as e:
-            review_last_page = "None"
-
-        RAM = 4500
-        max_pages = (RAM / 300) * 100
-        Logger.log_it("Performance: Pages limit %s | Pages to scrap %s" % (max_pages, review_last_page))
-        if review_last_page is None or review_last_page == "None":
-            return False
-        if int(review_last_page) > max_pages:
-            Logger.log_it("Skipping page")
-            Logger.log_performance_location(parent_url)
-            return True
-        return False
-
     def has_next_review_page(self):
         Logger.log_it("Checking if next page exists")
         return not (self.get_next_page_url() is None)
@@ -153,61 +300,50 @@ class GeckoReviewSpider(object):
                 break
         y = next_page.location['y']
         self.driver.execute_script("window.scrollTo(0, " + str(y - 200) + ");")
-        time.sleep(0.2)
+        self.wait_for(lambda driver: next_page.is_displayed() and next_page.is_enabled(), "next page link")
+        first_review = self.get_first_review()
         ActionChains(self.driver).move_to_element(next_page).click().perform()
-        time.sleep(0.4)
+        self.wait_for(lambda driver: self.get_current_page_number() not in (None, current_page), "page number change")
+        self.wait_for_reviews_reload(first_review)
 
     @stale_decorator
     def scrap_page(self, parent_url, scraped_pages, start_time, root_url):
-        time.sleep(0.2)
-        review_location_name = unicode_utils.unicode_to_string(
-            self.driver.find_element_by_css_selector('div h1.ui_header').text)
-        try:
-            review_current_page = unicode_utils.unicode_to_string(
-                self.driver.find_element_by_css_selector('div.pageNumbers span.current').text)
-        except NoSuchElementException as e:
+        self.wait_for(expected_conditions.presence_of_element_located((By.CSS_SELECTOR, 'div h1.ui_header')),
+                      "location header")
+        self.current_page = None
+        self.last_page = None
+        # Everything the page offers is read with one webdriver call
+        snapshot = self.driver.execute_script(PAGE_SNAPSHOT_SCRIPT)
+        if snapshot['location_name'] is None:
+            raise NoSuchElementException("Location header not found")
+
+        review_location_name = unicode_utils.unicode_to_string(snapshot['location_name'])
+        review_current_page = unicode_utils.unicode_to_string(snapshot['current_page'])
+        if review_current_page is None:
             review_current_page = "None"
 
-        try:
-            review_last_page = self.driver.find_elements_by_css_selector('div.pageNumbers a.pageNum')[-1].text
-        except Exception as e:
-            review_last_page = "None"
-
-        review_location_type = unicode_utils.unicode_list_to_string(
-            map(lambda x: x.text, self.driver.find_elements_by_css_selector('div._3RTCF0T0 a._1cn4vjE4')))
-        review_location_breadcrumbs = unicode_utils.unicode_list_to_string(
-            map(lambda x: x.text, self.driver.find_elements_by_css_selector('div ul.breadcrumbs li.breadcrumb a span')))
-        try:
-            review_location_rate = unicode_utils.unicode_rating_to_string(
-                self.driver.find_element_by_css_selector('div._1NKYRldB span.ui_bubble_rating').get_attribute('class'))
-        except:
-            review_location_rate = "0"
-
-        current_url = self.driver.current_url
-        current_url = current_url.replace(root_url, "")
-
-        pattern = re.compile(r"(?<=recentHistoryList', )(.*)(?=\);)")
-        html_content = self.driver.find_element_by_xpath("//*").get_attribute('outerHTML')
-        tripadvisor = re.search(pattern, html_content)
-        tripadvisor_data = "None"
-        for group in tripadvisor.groups():
-            if "coords" in group:
-                tripadvisor_data = group
-                break
-        tripadvisor_data = json.loads(tripadvisor_data)
+        review_last_page = "None"
+        if snapshot['pages']:
+            review_last_page = snapshot['pages'][-1]
+        self.current_page = int(review_current_page) if review_current_page.isdigit() else None
+        self.last_page = int(review_last_page) if review_last_page.isdigit() else None
+        if snapshot['all_languages'] is False:
+            Logger.log_it("All languages filter is not selected on " + snapshot['url'])
+
+        review_location_type = unicode_utils.unicode_list_to_string(snapshot['location_types'])
+        review_location_breadcrumbs = unicode_utils.unicode_list_to_string(snapshot['breadcrumbs'])
+        review_location_rate = unicode_utils.unicode_rating_to_string(snapshot['location_rate'])
+
+        tripadvisor_data = []
+        if snapshot['history'] is not None:
+            pattern = re.compile(r"(?<=recentHistoryList', )(.*)(?=\);)")
+            tripadvisor = re.search(pattern, snapshot['history'])
+            if tripadvisor is not None:
+                tripadvisor_data = json.loads(tripadvisor.group(0))
         location_lat, location_lng = coordinate_utils.parse_json_to_coords(tripadvisor_data)
 
         extra = []
-
-        grades = self.driver.find_elements_by_css_selector('div.ui_column ul._2lcHrbTn li.ui_checkbox._3gEj_Jb5')
-        for grade in grades:
-            key = grade.find_element_by_css_selector('label').text
-            try:
-                value = grade.find_element_by_css_selector('span._3fVK8yi6').text
-            except:
-                value = None
-            if value is None:
-                break
+        for key, value in snapshot['grades']:
             extra.append(key + " : " + value)
 
         extra = unicode_utils.unicode_list_to_string(extra)
@@ -215,23 +351,21 @@ class GeckoReviewSpider(object):
             extra = "None"
 
         reviews = []
-        for review in self.driver.find_elements_by_css_selector('div.main_content div.Dq9MAugU'):
-            review_id = unicode_utils.unicode_to_string(
-                review.find_element_by_css_selector('div.oETBfkHU').get_attribute('data-reviewid'))
-            review_date = unicode_utils.unicode_date_v2_to_string_number(
-                review.find_element_by_css_selector('div._2fxQ4TOx span').text)
+        for review in snapshot['reviews']:
+            if review['id'] is None or review['date'] is None or review['user_link'] is None:
+                raise NoSuchElementException("Review element not found")
+            review_id = unicode_utils.unicode_to_string(review['id'])
+            review_date = unicode_utils.unicode_date_v2_to_string_number(review['date'])
             try:
                 review_experience_date = unicode_utils.unicode_date_v3_to_string_number(
-                    review.find_element_by_css_selector('div._27JpaCjl span').text.split(':')[1])
+                    review['experience'].split(':')[1])
             except Exception:
                 review_experience_date = review_date
 
-            review_rate = unicode_utils.unicode_rating_to_string(
-                review.find_element_by_css_selector('span.ui_bubble_rating').get_attribute('class'))
+            review_rate = unicode_utils.unicode_rating_to_string(review['rate'])
 
-            user_name = unicode_utils.unicode_to_string(review.find_element_by_css_selector('a.ui_header_link').text)
-            user_link = unicode_utils.unicode_to_string(
-                review.find_element_by_css_selector('a.ui_header_link').get_attribute('href'))
+            user_name = unicode_utils.unicode_to_string(review['user_name'])
+            user_link = unicode_utils.unicode_to_string(review['user_link'])
             user_id = unicode_utils.unicode_string_to_md5(user_link)
 
             review_data = Review(review_location_name,
@@ -281,19 +415,15 @@ class GeckoReviewSpider(object):
         if review_current_page is not None:
             review_current_page = review_current_page.replace("/", "")
 
-        if review_current_page == '1':
-            last_scraped_page_url = file_utils.get_last_scraped_page_url(review_location_name, current_url)
-            if last_scraped_page_url is not None:
-                next_review_page_url = last_scraped_page_url
-
-        filename = 'scraped_data/data_reviews/%s/reviews-%s-%s.csv' % (
-            settings.COUNTRY, review_location_name, review_current_page)
-        with open(filename, 'w') as f:
-            f.write(Review.get_csv_header_v2())
-            for review in reviews:
-                f.write(review.get_csv_line())
-            f.close()
-        Logger.log_it('Saved %s reviews to file %s' % (len(reviews), filename))
+        if settings.CSV_OUTPUT:
+            filename = 'scraped_data/data_reviews/%s/reviews-%s-%s.csv' % (
+                settings.COUNTRY, review_location_name, review_current_page)
+            with open(filename, 'w') as f:
+                f.write(Review.get_csv_header_v2())
+                for review in reviews:
+                    f.write(review.get_csv_line())
+                f.close()
+            Logger.log_it('Saved %s reviews to file %s' % (len(reviews), filename))
 
         try:
             current_time = time.time()
@@ -308,6 +438,8 @@ class GeckoReviewSpider(object):
             Logger.log_it('Reviews: %s/%s' % (review_current_page, review_last_page))
         if no_reviews:
             Logger.log_it("Location had no reviews. None values with coords were collected.")
+        self.record_page_wait()
+        return reviews
 
     def continue_scraping(self):
         # self.driver.execute_script()
@@ -327,9 +459,15 @@ class GeckoReviewSpider(object):
 
     def stop_spider(self):
         Logger.log_it("-------------------------------------------")
-        self.driver.close()
+        self.driver.quit()
         self.timer.stop_timer()
         Logger.log_it(self.timer.print_time())
+        if self.wait_times:
+            # Fixed sleeps used before were 0.8 seconds per page (0.2 + 0.4 in next_page, 0.2 in scrap_page)
+            total_wait = sum(self.wait_times)
+            pages = len(self.wait_times)
+            Logger.log_time("Page waits: %s pages | %.3f seconds total | %.3f seconds per page | %.3f seconds saved" % (
+                pages, total_wait, total_wait / pages, pages * 0.8 - total_wait))
 
 
 def get_coordinates(url):
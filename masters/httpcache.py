@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+# Content addressed http cache for all spiders
+#
+# Response bodies are stored once per sha1 of their content (gzip compressed) and an sqlite index maps
+# request fingerprints to them. HTTPCACHE_MODE selects:
+#   record - every request is downloaded and (re)stored
+#   replay - every request is answered from the cache, requests which are not cached are ignored (no network)
+#
+#     scrapy crawl reviews -a location=<url> -s HTTPCACHE_ENABLED=1 -s HTTPCACHE_MODE=replay
+#
+# List and prune entries with
+#
+#     python httpcache.py list [--spider reviews] [--url <part of url>]
+#     python httpcache.py prune [--spider reviews] [--url <part of url>] [--older-than <days>]
+#
+# In replay mode the filter of downloaded pages (FINGERPRINT_FILTER_FILE) is neither read nor written.
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.append("..")
+
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+
+from masters import settings as project_settings
+from masters.utils import url_utils
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+
+def is_replay(settings):
+    # Crawl answered from the cache, pages downloaded before must be seen again
+    return settings.getbool('HTTPCACHE_ENABLED') and settings.get('HTTPCACHE_MODE', MODE_RECORD) == MODE_REPLAY
+
+
+def get_request_fingerprint(method, url, body=b""):
+    fingerprint = hashlib.sha1()
+    fingerprint.update(method.encode())
+    fingerprint.update(url_utils.strip_fragment(url).encode())
+    fingerprint.update(body or b"")
+    return fingerprint.hexdigest()
+
+
+class ResponseStore(object):
+    def __init__(self, cachedir, compress_level=6):
+        self.cachedir = cachedir
+        self.compress_level = compress_level
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+        # Waits for the other writer (a crawl recording or httpcache.py prune) instead of failing
+        self.conn = sqlite3.connect(os.path.join(cachedir, "index.db"), timeout=60)
+        self.conn.execute(""" CREATE TABLE IF NOT EXISTS responses (
+                                fingerprint text,
+                                spider text,
+                                url text,
+                                status integer,
+                                headers text,
+                                body_hash text,
+                                created_at real,
+                                PRIMARY KEY (fingerprint)
+                            ); """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_body_hash ON responses(body_hash)")
+        self.conn.commit()
+
+    def get_body_path(self, body_hash):
+        return os.path.join(self.cachedir, "bodies", body_hash[:2], body_hash[2:] + ".gz")
+
+    def get(self, fingerprint):
+        row = self.conn.execute("SELECT url, status, headers, body_hash FROM responses WHERE fingerprint = ?",
+                                (fingerprint,)).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body_hash = row
+        try:
+            with gzip.open(self.get_body_path(body_hash), 'rb') as f:
+                body = f.read()
+        except IOError:
+            return None
+        return url, status, json.loads(headers), body
+
+    def put(self, fingerprint, spider, url, status, headers, body):
+        # Entry is committed right away, so a killed crawl keeps what it recorded and doesn't hold the write lock
+        body_hash = hashlib.sha1(body).hexdigest()
+        path = self.get_body_path(body_hash)
+        if not os.path.exists(path):
+            folder = os.path.dirname(path)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            with gzip.open(path + ".tmp", 'wb', self.compress_level) as f:
+                f.write(body)
+            os.rename(path + ".tmp", path)
+        self.conn.execute(''' INSERT OR REPLACE INTO responses(fingerprint, spider, url, status, headers, body_hash, created_at)
+                              VALUES(?,?,?,?,?,?,?) ''',
+                          (fingerprint, spider, url, status, json.dumps(headers), body_hash, time.time()))
+        self.conn.commit()
+
+    def select(self, spider=None, url=None, older_than=None):
+        sql = "SELECT fingerprint, spider, url, status, body_hash, created_at FROM responses WHERE 1 = 1"
+        params = []
+        if spider is not None:
+            sql += " AND spider = ?"
+            params.append(spider)
+        if url is not None:
+            sql += " AND url LIKE ?"
+            params.append("%" + url + "%")
+        if older_than is not None:
+            sql += " AND created_at < ?"
+            params.append(older_than)
+        return self.conn.execute(sql + " ORDER BY created_at", params)
+
+    def delete(self, fingerprints):
+        self.conn.executemany("DELETE FROM responses WHERE fingerprint = ?", [(f,) for f in fingerprints])
+        self.conn.commit()
+
+    def remove_orphan_bodies(self):
+        # Bodies which are not referenced by any entry anymore
+        used = set(row[0] for row in self.conn.execute("SELECT DISTINCT body_hash FROM responses"))
+        removed = 0
+        root = os.path.join(self.cachedir, "bodies")
+        if not os.path.exists(root):
+            return removed
+        for folder in os.listdir(root):
+            for file in os.listdir(os.path.join(root, folder)):
+                if folder + file.replace(".gz", "") not in used:
+                    os.remove(os.path.join(root, folder, file))
+                    removed += 1
+        return removed
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class ContentAddressedCacheStorage(object):
+    # HTTPCACHE_STORAGE for scrapy's HttpCacheMiddleware
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.mode = settings.get('HTTPCACHE_MODE', MODE_RECORD)
+        self.compress_level = settings.getint('HTTPCACHE_GZIP_LEVEL', 6)
+        self.store = None
+
+    def open_spider(self, spider):
+        self.store = ResponseStore(self.cachedir, self.compress_level)
+        spider.logger.info("Http cache in %s mode: %s" % (self.mode, self.cachedir))
+
+    def close_spider(self, spider):
+        self.store.close()
+
+    def retrieve_response(self, spider, request):
+        if self.mode == MODE_RECORD:
+            return None
+        cached = self.store.get(get_request_fingerprint(request.method, request.url, request.body))
+        if cached is None:
+            raise IgnoreRequest("Not in http cache: %s" % request.url)
+        url, status, headers, body = cached
+        headers = Headers(headers)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body, request=request)
+
+    def store_response(self, spider, request, response):
+        if self.mode == MODE_REPLAY:
+            return
+        headers = dict((key.decode('latin1'), [value.decode('latin1') for value in values])
+                       for key, values in response.headers.items())
+        self.store.put(get_request_fingerprint(request.method, request.url, request.body),
+                       spider.name, response.url, response.status, headers, response.body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List or prune the http cache")
+    parser.add_argument("command", choices=["list", "prune"])
+    parser.add_argument("--spider")
+    parser.add_argument("--url", help="part of url")
+    parser.add_argument("--older-than", type=float, help="days")
+    args = parser.parse_args()
+
+    older_than = None
+    if args.older_than is not None:
+        older_than = time.time() - args.older_than * 24 * 3600
+    store = ResponseStore(data_path(project_settings.HTTPCACHE_DIR, createdir=True))
+    entries = store.select(args.spider, args.url, older_than).fetchall()
+    if args.command == "list":
+        for fingerprint, spider, url, status, body_hash, created_at in entries:
+            print("%s %s %s %s %s" % (time.strftime("%Y-%m-%d %H:%M", time.localtime(created_at)), spider, status,
+                                      body_hash[:10], url))
+        print("%s entries" % len(entries))
+    else:
+        store.delete([entry[0] for entry in entries])
+        print("Removed %s entries and %s bodies" % (len(entries), store.remove_orphan_bodies()))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
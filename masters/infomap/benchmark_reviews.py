@@ -0,0 +1,141 @@
+import argparse
+import importlib.util
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append("../..")
+
+from masters.data_managers.utils import database_schema
+from masters.data_structures.AttractionInfomap import AttractionInfomap
+from masters.data_structures.EdgeInfomap import EdgeInfomap
+from masters.data_structures.ReviewInfomap import ReviewInfomap
+from masters.infomap import infomap_edges
+
+# infomap_data/ (output folder) shadows infomap_data.py, the module is loaded from its file
+spec = importlib.util.spec_from_file_location(
+    "infomap_data", os.path.join(os.path.dirname(os.path.abspath(__file__)), "infomap_data.py"))
+infomap_data = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(infomap_data)
+
+# Reading reviews and building edges of the Infomap network from a synthetic database
+#
+#     python benchmark_reviews.py --reviews 1000000
+#
+# join        - infomap_data.get_reviews, one query resolving the attraction of every review, streamed
+# per-row     - all reviews loaded first, then the attraction of every review looked up with its own query
+#               (as get_reviews did before, here with an indexed lookup)
+# vectorised  - infomap_edges.get_edges over integer codes and day ordinals
+# loop        - edges counted review by review as get_edges did before (yyyymmdd dates subtracted)
+
+
+def create_database(db_file, reviews, users, locations):
+    conn = sqlite3.connect(db_file)
+    database_schema.create_database(conn)
+    database_schema.drop_indexes(conn)
+    random.seed(1)
+    location_rows = []
+    for location_id in range(1, locations + 1):
+        url = "/Attraction_Review-g%d-d%d-Reviews-Location_%d.html" % (location_id % 100, location_id, location_id)
+        location_rows.append(("Location %d" % location_id, 4.5, "Museums", url, "/Attractions-g%d" % (location_id % 100),
+                              location_id, location_id % 100, location_id % 100))
+    conn.executemany(database_schema.get_insert_sql('locations'), location_rows)
+
+    def review_rows():
+        for review_id in range(1, reviews + 1):
+            location_id = random.randint(1, locations)
+            user = random.randint(1, users)
+            review_date = 20100101 + random.randint(0, 10) * 10000 + random.randint(1, 12) * 100 + random.randint(0, 27)
+            yield ("Location %d" % location_id, 1, 10, "Museums", "Europe", 4.5, 46.0, 14.5, review_id, review_date,
+                   review_date, 5.0, "user %d" % user, "/Profile/user%d" % user, "%032x" % user, None,
+                   location_rows[location_id - 1][3], location_id)
+    conn.executemany(database_schema.get_insert_sql('reviews'), review_rows())
+    database_schema.create_indexes(conn)
+    conn.commit()
+    conn.close()
+
+
+def read_per_row(conn):
+    # Whole result in memory, one query per review
+    rows = conn.execute("SELECT review_location_name, review_location_type, location_lat, location_lng, review_id, "
+                        "review_date, user_id, review_location_rate, review_rate, user_name, parent_url, location_id "
+                        "FROM reviews ORDER BY user_id, review_id").fetchall()
+    attractions = {}
+    reviews = []
+    for row in rows:
+        location = conn.execute("SELECT attraction_name, attraction_url FROM locations WHERE location_id = ?",
+                                (row[11],)).fetchone()
+        attraction = attractions.get(row[11])
+        if attraction is None:
+            attraction = AttractionInfomap(location[0], location[1], len(attractions) + 1)
+            attractions[row[11]] = attraction
+        reviews.append(ReviewInfomap(*(row[:11] + (None, attraction))))
+    return len(reviews)
+
+
+def read_join(conn):
+    return sum(1 for review in infomap_data.get_reviews(conn))
+
+
+def edges_loop(conn):
+    # Consecutive reviews compared one by one in python, edge objects rebuilt on every increment
+    edges = {}
+    prev = None
+    for review in infomap_data.get_reviews(conn):
+        if prev is not None and review.user_id == prev.user_id and review.review_date - prev.review_date < 30:
+            key = (prev.attraction.location_id, review.attraction.location_id)
+            weight = edges[key].weight + 1 if key in edges else 1
+            edges[key] = EdgeInfomap(weight, prev, review)
+        prev = review
+    return len(edges)
+
+
+def edges_vectorised(conn):
+    return len(infomap_edges.get_edges(infomap_edges.read_reviews(conn)))
+
+
+def get_memory():
+    # Peak resident memory of the process in MB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of reading reviews for the Infomap network")
+    parser.add_argument("--reviews", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=200000)
+    parser.add_argument("--locations", type=int, default=20000)
+    parser.add_argument("--db", help="existing benchmark database, a temporary one is created by default")
+    args = parser.parse_args()
+
+    db_file = args.db
+    if db_file is None:
+        db_file = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    if not os.path.exists(db_file):
+        start_time = time.time()
+        create_database(db_file, args.reviews, args.users, args.locations)
+        print("Created %s in %.1f s" % (db_file, time.time() - start_time))
+
+    # join first, peak memory only grows
+    for name, read in (("join", read_join), ("per-row", read_per_row)):
+        conn = sqlite3.connect(db_file)
+        start_time = time.time()
+        count = read(conn)
+        seconds = time.time() - start_time
+        conn.close()
+        print("%-8s %s reviews in %.1f s (%.0f reviews/s), peak memory %.0f MB" % (
+            name, count, seconds, count / max(seconds, 1e-6), get_memory()))
+
+    for name, build in (("vectorised", edges_vectorised), ("loop", edges_loop)):
+        conn = sqlite3.connect(db_file)
+        start_time = time.time()
+        count = build(conn)
+        conn.close()
+        print("edges %-10s %s edges in %.1f s" % (name, count, time.time() - start_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,144 +1,117 @@
-import sqlite3
+import itertools
 
+from masters.data_managers.utils import database_partitions
+from masters.data_managers.utils import database_queries
 from masters.data_structures.ReviewInfomap import ReviewInfomap
 from masters.data_structures.AttractionInfomap import AttractionInfomap
-from masters.data_structures.EdgeInfomap import EdgeInfomap
-
-
-def create_connection(db_file):
-    """ create a database connection to the SQLite database
-        specified by db_file
-    :param db_file: database file
-    :return: Connection object or None
-    """
-    conn = None
-    try:
-        conn = sqlite3.connect(db_file)
-        return conn
-    except sqlite3.Error as e:
-        print(e)
-    return conn
-
-
-def get_review_by_location_name(conn, review_name):
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM reviews WHERE location_name = ?", (review_name,))
-    for row in cur.fetchall():
-        return row
-
-
-def get_reviews():
-    conn = create_connection('../database/data.db')
-    cur = conn.cursor()
-    cur.execute(
-        "select * from reviews order by user_id, review_id asc")
-    reviews = []
-    attractions = get_attractions_cursor()
-    for review in cur.fetchall():
-        url = review[11]
-        if 'html' not in url:
-            url = get_review_by_location_name(conn, review[1])[11]
-        review_data = ReviewInfomap(review[1],
-                                    review[2],
-                                    review[3],
-                                    review[4],
-                                    review[5],
-                                    review[6],
-                                    review[7],
-                                    review[8],
-                                    review[9],
-                                    review[10],
-                                    url,
-                                    review[12],
-                                    attractions[url])
-        reviews.append(review_data)
-    return reviews
-
-
-def get_attractions_cursor():
-    conn = create_connection('../database/data.db')
-    cur = conn.cursor()
-    cur.execute("select * from attractions")
+from masters.infomap import infomap_edges
+
+
+# Scraped database, read through database_queries (read only, streamed)
+db = "../data/databases/data.db"
+
+# Reviews with their attraction resolved in one query: locations are joined by location_id, reviews of a location
+# which is not in the database keep their parent_url as attraction. Ordered by user, so reviews of one user come
+# one after another.
+sql_reviews = """
+    SELECT r.review_location_name, r.review_location_type, r.location_lat, r.location_lng, r.review_id,
+           r.review_date, r.user_id, r.review_location_rate, r.review_rate, r.user_name, r.parent_url,
+           r.location_id, COALESCE(l.attraction_name, r.review_location_name),
+           COALESCE(l.attraction_url, r.parent_url)
+    FROM reviews r
+    LEFT JOIN locations l ON l.location_id = r.location_id
+    WHERE +r.review_date IS NOT NULL AND r.user_id IS NOT NULL %s
+    ORDER BY r.user_id, r.review_id
+"""
+
+
+def get_connection(db_file=db):
+    return database_queries.get_connection(db_file)
+
+
+def get_reviews(conn=None, country=None):
+    # ReviewInfomap of all reviews (of a country), streamed and grouped by user (ordered by user_id, review_id).
+    # Reviews of the same location share one AttractionInfomap.
+    if conn is None:
+        conn = get_connection()
+    condition = ""
+    parameters = ()
+    if country is not None:
+        condition = "AND r." + database_queries.get_country_condition('reviews')
+        parameters = (database_partitions.get_country_name(country),)
+    attractions = {}
+    for row in database_queries.iter_query(sql_reviews % condition, parameters, conn=conn):
+        location_id = row[11]
+        attraction = attractions.get(location_id)
+        if attraction is None:
+            attraction = AttractionInfomap(row[12], row[13], len(attractions) + 1)
+            attractions[location_id] = attraction
+        yield ReviewInfomap(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9],
+                            row[10], None, attraction)
+
+
+def get_user_reviews(conn=None, country=None):
+    # (user_id, list of ReviewInfomap) of every user
+    for user_id, reviews in itertools.groupby(get_reviews(conn, country), key=lambda review: review.user_id):
+        yield user_id, list(reviews)
+
+
+def get_attractions_cursor(conn=None):
+    if conn is None:
+        conn = get_connection()
+    # Keyed by location_id (d<detail id> of the url)
     attractions = dict()
     i = 1
-    for attraction in cur.fetchall():
-        attr = AttractionInfomap(attraction[0], attraction[0], i)
-        attractions[attr.attraction_url] = attr
+    for attraction in database_queries.iter_query("SELECT attraction_name, attraction_url FROM locations", conn=conn):
+        attr = AttractionInfomap(attraction[0], attraction[1], i)
+        attractions[attr.location_id] = attr
         i += 1
     return attractions
 
 
-def save_pajek_format(edges, name):
+def save_pajek_format(edges, attractions, name):
+    # edges of infomap_edges.get_edges, vertices are named by their attraction (location_id when it is not known)
     filename = 'infomap_data/net_files/' + name
     vertices = {}
-    i = 1
-    for edge in edges.items():
-        k1 = edge[1].review_from.attraction
-        k2 = edge[1].review_to.attraction
-        if k1.attraction_url not in vertices:
-            vertices[k1.attraction_url] = (i, k1)
-            i += 1
-        if k2.attraction_url not in vertices:
-            vertices[k2.attraction_url] = (i, k2)
-            i += 1
+    for location_id in itertools.chain.from_iterable(zip(edges['from_location_id'], edges['to_location_id'])):
+        if location_id not in vertices:
+            vertices[location_id] = len(vertices) + 1
 
     with open(filename, 'w+') as f:
         f.write("*Vertices " + str(vertices.__len__()) + "\n")
-        for vertice in vertices.items():
-            f.write(str(vertice[1][0]) + " \"" + vertice[0].split("-Reviews-")[1] + "\" 1.0\n")
-        f.write("*Edges " + str(edges.__len__()) + "\n")
-        for edge in edges.items():
-            tmp = edge[0].split(" ")
-            url_from = tmp[0]
-            url_to = tmp[1]
-            key = str(vertices[url_from][0]) + " " + str(vertices[url_to][0])
-            f.write(key + " " + str(edge[1].weight) + "\n")
+        for location_id, number in vertices.items():
+            attraction = attractions.get(location_id)
+            label = attraction.attraction_url.split("-Reviews-")[1] if attraction else str(location_id)
+            f.write(str(number) + " \"" + label + "\" 1.0\n")
+        f.write("*Arcs " + str(edges.__len__()) + "\n")
+        for id_from, id_to, weight in zip(edges['from_location_id'], edges['to_location_id'], edges['weight']):
+            f.write(str(vertices[id_from]) + " " + str(vertices[id_to]) + " " + str(weight) + "\n")
 
 # TODO add attraction weight
 
-def get_key_from_locations(l1, l2):
-    # if l1.number < l2.number:
-    return str(l1.attraction_url) + " " + str(l2.attraction_url)
-    # return str(l2.attraction_url) + " " + str(l1.attraction_url)
-
-
-def get_edges():
-    edges = {}
-    prev = None
-    reviews = get_reviews()
-    for review in reviews:
-        if prev is None:
-            prev = review
-            continue
-        if review.user_id == prev.user_id:  # if is the same user
-            if review.review_date - prev.review_date < 30:  # if time between visit is less then 30
-                key = get_key_from_locations(review.attraction, prev.attraction)  # get key for edges
-                if edges.get(key):
-                    edges[key] = EdgeInfomap(edges[key].weight + 1, prev, review)
-                else:
-                    edges[key] = EdgeInfomap(1, prev, review)
-        prev = review
-    return edges
-
-
-def filter_edges(edges):
-    new_edges = {}
-    for edge in edges.items():
-        if edge[1].weight > 15:
-            new_edges[edge[0]] = edge[1]
-    return new_edges
-
-
-def get_pajek_format():
+
+def get_edges(conn=None, country=None, window_days=infomap_edges.window_days):
+    # Directed transitions between attractions of consecutive reviews of a user written less than window_days apart
+    if conn is None:
+        conn = get_connection()
+    return infomap_edges.get_edges(infomap_edges.read_reviews(conn, country), window_days)
+
+
+def filter_edges(edges, min_weight=15):
+    return edges[edges['weight'] > min_weight]
+
+
+def get_pajek_format(window_days=infomap_edges.window_days):
     # get all edges top map {n - m: {from, to, weight}} position to position weight
-    edges = get_edges()
+    edges = get_edges(window_days=window_days)
     print("Edges grouped...")
 
     edges = filter_edges(edges)
     print("Edges filtered...")
 
-    save_pajek_format(edges, 'all_w15_directed.net')
+    save_pajek_format(edges, get_attractions_cursor(), 'all_w15_directed.net')
     print("Pajek saved...")
 
 
-get_pajek_format()
+if __name__ == '__main__':
+    get_pajek_format()
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from masters.data_managers.utils import database_partitions
+from masters.data_managers.utils import database_queries
+
+# Co-visitation edges of the Infomap network: two consecutive reviews of the same user written less than
+# window_days apart are a transition from the first attraction to the second. Users and attractions are
+# turned into integer codes and review dates (yyyymmdd) into day ordinals, all transitions are counted in
+# one vectorised pass.
+
+window_days = 30
+
+sql_reviews = """
+    SELECT user_id, location_id, review_date, review_id FROM reviews
+    WHERE user_id IS NOT NULL AND +review_date IS NOT NULL %s
+"""
+
+
+def read_reviews(conn, country=None):
+    # DataFrame with user_id, location_id, review_date and review_id of all reviews (of a country)
+    condition = ""
+    parameters = ()
+    if country is not None:
+        condition = "AND " + database_queries.get_country_condition('reviews')
+        parameters = (database_partitions.get_country_name(country),)
+    return pd.read_sql_query(sql_reviews % condition, conn, params=parameters)
+
+
+def get_day_ordinals(dates):
+    # Days since 1970-01-01 of yyyymmdd dates and mask of the valid ones (20190230 is not)
+    dates = np.asarray(dates, dtype=np.int64)
+    months = dates // 100 % 100
+    days = dates % 100
+    month_numbers = (dates // 10000 - 1970) * 12 + np.clip(months, 1, 12) - 1
+    month_starts = month_numbers.astype('datetime64[M]').astype('datetime64[D]')
+    next_month_starts = (month_numbers + 1).astype('datetime64[M]').astype('datetime64[D]')
+    ordinals = month_starts + (days - 1).astype('timedelta64[D]')
+    valid = (months >= 1) & (months <= 12) & (days >= 1) & (ordinals < next_month_starts)
+    return ordinals.astype(np.int64), valid
+
+
+def get_edges(reviews, window_days=window_days):
+    # DataFrame of directed edges (from_location_id, to_location_id, weight) of reviews (read_reviews), sorted by
+    # weight. Reviews of a user are ordered by date and review_id.
+    days, valid = get_day_ordinals(reviews['review_date'].values)
+    user_codes = pd.factorize(reviews['user_id'])[0][valid]
+    location_codes, location_ids = pd.factorize(reviews['location_id'])
+    location_codes = location_codes[valid]
+    days = days[valid]
+    review_ids = reviews['review_id'].values[valid]
+
+    order = np.lexsort((review_ids, days, user_codes))
+    user_codes = user_codes[order]
+    location_codes = location_codes[order]
+    days = days[order]
+
+    transitions = (user_codes[1:] == user_codes[:-1]) & (days[1:] - days[:-1] < window_days)
+    sources = location_codes[:-1][transitions].astype(np.int64)
+    targets = location_codes[1:][transitions].astype(np.int64)
+    pairs, weights = np.unique(sources * len(location_ids) + targets, return_counts=True)
+
+    location_ids = np.asarray(location_ids)
+    edges = pd.DataFrame({
+        'from_location_id': location_ids[pairs // len(location_ids)],
+        'to_location_id': location_ids[pairs % len(location_ids)],
+        'weight': weights,
+    })
+    return edges.sort_values('weight', ascending=False, kind='mergesort').reset_index(drop=True)
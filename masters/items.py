@@ -4,11 +4,69 @@
 #
 # See documentation in:
 # http://doc.scrapy.org/en/latest/topics/items.html
+#
+# Items hold the columns of their database table (data_managers/utils/database_schema.py)
 
 import scrapy
 
+from masters.data_managers.utils import database_schema
+
+
+class DatabaseItem(scrapy.Item):
+    table = None
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(zip(database_schema.columns[cls.table], row))
+
+    def get_row(self):
+        return tuple(self.get(column) for column in database_schema.columns[self.table])
+
+
+class FetchedPageItem(scrapy.Item):
+    # Comes after all items of a downloaded page (FetchedPageMiddleware), page is marked as downloaded by the
+    # pipeline once they are committed
+    fingerprint = scrapy.Field()
+
+
+class ProvinceItem(DatabaseItem):
+    table = 'provinces'
+    province_name = scrapy.Field()
+    region_name = scrapy.Field()
+    province_url = scrapy.Field()
+    country = scrapy.Field()
+    province_id = scrapy.Field()
+
+
+class LocationItem(DatabaseItem):
+    table = 'locations'
+    attraction_name = scrapy.Field()
+    attraction_rate = scrapy.Field()
+    attraction_type = scrapy.Field()
+    attraction_url = scrapy.Field()
+    attraction_parent_url = scrapy.Field()
+    location_id = scrapy.Field()
+    geo_id = scrapy.Field()
+    province_id = scrapy.Field()
+
 
-class MastersItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+class ReviewItem(DatabaseItem):
+    table = 'reviews'
+    review_location_name = scrapy.Field()
+    review_current_page = scrapy.Field()
+    review_last_page = scrapy.Field()
+    review_location_type = scrapy.Field()
+    review_location_breadcrumbs = scrapy.Field()
+    review_location_rate = scrapy.Field()
+    location_lat = scrapy.Field()
+    location_lng = scrapy.Field()
+    review_id = scrapy.Field()
+    review_date = scrapy.Field()
+    review_experience_date = scrapy.Field()
+    review_rate = scrapy.Field()
+    user_name = scrapy.Field()
+    user_link = scrapy.Field()
+    user_id = scrapy.Field()
+    extra = scrapy.Field()
+    parent_url = scrapy.Field()
+    location_id = scrapy.Field()
@@ -0,0 +1,156 @@
+import atexit
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+sys.path.append("..")
+
+from masters import settings
+
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+KIND_PROVINCE = "province"
+KIND_LOCATION = "location"
+
+
+def get_kind(url):
+    if "Attraction_Review" in url:
+        return KIND_LOCATION
+    return KIND_PROVINCE
+
+
+class CrawlState(object):
+    # Status of every province/location url keyed by url, so skip checks are a single index lookup.
+    # Updates are buffered and written in batches, reads see buffered updates as well.
+
+    def __init__(self, db_file=settings.CRAWL_STATE_DB, batch_size=settings.CRAWL_STATE_BATCH):
+        folder = os.path.dirname(db_file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute(""" CREATE TABLE IF NOT EXISTS crawl_state (
+                                url text,
+                                kind text,
+                                status text,
+                                attempts integer,
+                                pages integer,
+                                created_at real,
+                                updated_at real,
+                                PRIMARY KEY (url)
+                            ); """)
+        self.conn.commit()
+
+    def is_empty(self):
+        with self.lock:
+            return not self.pending and self.conn.execute("SELECT 1 FROM crawl_state LIMIT 1").fetchone() is None
+
+    def get_status(self, url):
+        with self.lock:
+            if url in self.pending:
+                return self.pending[url][2]
+            row = self.conn.execute("SELECT status FROM crawl_state WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def get_pages(self, url):
+        with self.lock:
+            if url in self.pending and self.pending[url][4] is not None:
+                return self.pending[url][4]
+            row = self.conn.execute("SELECT pages FROM crawl_state WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def is_scraped(self, url):
+        return self.get_status(url) == STATUS_DONE
+
+    def set_status(self, url, status, pages=None, attempt=True):
+        now = time.time()
+        with self.lock:
+            attempts = 1 if attempt else 0
+            if url in self.pending:
+                previous = self.pending[url]
+                attempts += previous[3]
+                if pages is None:
+                    pages = previous[4]
+            self.pending[url] = (url, get_kind(url), status, attempts, pages, now, now)
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        sql = ''' INSERT INTO crawl_state(url, kind, status, attempts, pages, created_at, updated_at)
+                  VALUES(?,?,?,?,?,?,?)
+                  ON CONFLICT(url) DO UPDATE SET
+                    status = excluded.status,
+                    attempts = crawl_state.attempts + excluded.attempts,
+                    pages = coalesce(excluded.pages, crawl_state.pages),
+                    updated_at = excluded.updated_at '''
+        self.conn.executemany(sql, list(self.pending.values()))
+        self.conn.commit()
+        self.pending = {}
+
+    def import_logs(self, scraped_log='logs/scraped_locations.log'):
+        # One time import of the old log file of scraped locations
+        imported = 0
+        if os.path.exists(scraped_log):
+            with open(scraped_log) as f:
+                for line in f:
+                    url = line.strip()
+                    if url:
+                        self.set_status(url, STATUS_DONE, attempt=False)
+                        imported += 1
+        self.flush()
+        return imported
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+crawl_state = None
+crawl_state_lock = threading.Lock()
+
+
+def get_crawl_state():
+    global crawl_state
+    with crawl_state_lock:
+        if crawl_state is None:
+            crawl_state = CrawlState()
+            if crawl_state.is_empty():
+                crawl_state.import_logs()
+            atexit.register(crawl_state.flush)
+    return crawl_state
+
+
+def is_scraped(url):
+    return get_crawl_state().is_scraped(url)
+
+
+def get_pages(url):
+    return get_crawl_state().get_pages(url)
+
+
+def mark_done(url, pages=None):
+    get_crawl_state().set_status(url, STATUS_DONE, pages)
+
+
+def mark_failed(url):
+    get_crawl_state().set_status(url, STATUS_FAILED)
+
+
+if __name__ == '__main__':
+    # python managers/crawl_state_manager.py -> (re)import logs/scraped_locations.log
+    print("Imported %s urls" % CrawlState().import_logs())
@@ -0,0 +1,128 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+
+sys.path.append("..")
+
+from masters import settings
+from masters.utils import url_utils
+
+HEADER = struct.Struct("<4sIQ")
+MAGIC = b"MBF1"
+
+
+def get_fingerprint(url, method="GET", body=b""):
+    # Same page gives the same fingerprint whatever its host (.com, .co.uk), fragment or offset 0 is
+    fingerprint = hashlib.sha1()
+    fingerprint.update(method.encode())
+    fingerprint.update(url_utils.canonicalize_url(url).encode())
+    fingerprint.update(body or b"")
+    return fingerprint.digest()
+
+
+class BloomFilter(object):
+    # Bloom filter of sha1 fingerprints, in memory or in a memory mapped file which survives restarts.
+    # A file keeps the size it was created with. False positive rate stays under error_rate up to capacity entries.
+
+    def __init__(self, path=None, capacity=settings.FINGERPRINT_FILTER_CAPACITY,
+                 error_rate=settings.FINGERPRINT_FILTER_ERROR_RATE):
+        self.lock = threading.Lock()
+        self.file = None
+        bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.size = (bits + 7) // 8 * 8
+        self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        if path is None:
+            self.bits = bytearray(self.size // 8)
+            self.offset = 0
+            return
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, self.hashes, self.size))
+                f.truncate(HEADER.size + self.size // 8)
+        self.file = open(path, "r+b")
+        magic, self.hashes, self.size = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("Not a fingerprint filter file: %s" % path)
+        self.bits = mmap.mmap(self.file.fileno(), 0)
+        self.offset = HEADER.size
+
+    def get_positions(self, fingerprint):
+        # Double hashing, both hashes are parts of the (already uniform) sha1
+        first = int.from_bytes(fingerprint[:8], "little")
+        second = int.from_bytes(fingerprint[8:16], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def contains(self, fingerprint):
+        with self.lock:
+            for position in self.get_positions(fingerprint):
+                if not self.bits[self.offset + position // 8] & (1 << position % 8):
+                    return False
+            return True
+
+    def add(self, fingerprint):
+        # Returns True when the fingerprint was not in the filter before
+        added = False
+        with self.lock:
+            for position in self.get_positions(fingerprint):
+                index = self.offset + position // 8
+                mask = 1 << position % 8
+                if not self.bits[index] & mask:
+                    self.bits[index] |= mask
+                    added = True
+        return added
+
+    def flush(self):
+        if self.file is not None:
+            with self.lock:
+                self.bits.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.bits.close()
+            self.file.close()
+            self.file = None
+
+
+fingerprints = None
+fingerprints_lock = threading.Lock()
+# Off for http cache replays (dupefilters.FingerprintDupeFilter)
+enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def get_fingerprints():
+    # Filter of pages downloaded by any spider (scrapy or gecko), None when FINGERPRINT_FILTER_FILE is not set
+    global fingerprints
+    if not settings.FINGERPRINT_FILTER_FILE or not enabled:
+        return None
+    with fingerprints_lock:
+        if fingerprints is None:
+            fingerprints = BloomFilter(settings.FINGERPRINT_FILTER_FILE)
+    return fingerprints
+
+
+def is_fetched(url):
+    fetched = get_fingerprints()
+    return fetched is not None and fetched.contains(get_fingerprint(url))
+
+
+def mark_fetched(url):
+    mark_fingerprint(get_fingerprint(url))
+
+
+def mark_fingerprint(fingerprint):
+    fetched = get_fingerprints()
+    if fetched is not None:
+        fetched.add(fingerprint)
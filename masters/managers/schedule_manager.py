@@ -0,0 +1,78 @@
+import re
+import threading
+import time
+
+from urllib.request import Request, urlopen
+
+from masters import settings
+from masters.data_managers.utils import database_utils
+from masters.managers import crawl_state_manager
+from masters.utils import url_utils
+from masters.utils.logger_utils import Logger
+
+page_number_pattern = re.compile(r'class="pageNum[^"]*"[^>]*>(\d+)<')
+
+
+def probe_pages(parent_url, domain="https://www.tripadvisor.com"):
+    # Number of review pages read from the first page of the location (one plain http request, no browser)
+    try:
+        request = Request(domain + parent_url, headers={'User-Agent': settings.USER_AGENT})
+        html = urlopen(request, timeout=settings.GECKO_WAIT_TIMEOUT).read().decode('utf-8', 'ignore')
+    except Exception as e:
+        Logger.log_it("Probe of %s failed: %s" % (parent_url, str(e)))
+        return None
+    pages = [int(page) for page in page_number_pattern.findall(html)]
+    if not pages:
+        return 1
+    return max(pages)
+
+
+def get_expected_pages(parent_urls, countries=None, probe=settings.SCHEDULE_PROBE):
+    # Expected review pages of every location: review_last_page from the data of countries or pages of a previous
+    # crawl, a first page probe when nothing is known (if enabled) and SCHEDULE_DEFAULT_PAGES otherwise
+    known_pages = database_utils.load_review_page_counts(countries)
+    expected = {}
+    for parent_url in parent_urls:
+        pages = max(known_pages.get(url_utils.get_location_id(parent_url)) or 0,
+                    crawl_state_manager.get_pages(parent_url) or 0)
+        if not pages and probe:
+            pages = probe_pages(parent_url)
+        expected[parent_url] = pages or settings.SCHEDULE_DEFAULT_PAGES
+    return expected
+
+
+def order_by_cost(parent_urls, expected_pages):
+    # Longest job first: biggest locations start first, so no worker is left with a giant location at the end
+    return sorted(parent_urls, key=lambda parent_url: expected_pages[parent_url], reverse=True)
+
+
+class PageEta(object):
+    # Estimates remaining time from scraped pages instead of scraped locations
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total_pages = 0
+        self.done_pages = 0
+        self.start_time = time.time()
+
+    def start(self):
+        self.start_time = time.time()
+
+    def add(self, pages):
+        # Also used to correct the estimate once real page count of a location is known
+        with self.lock:
+            self.total_pages += pages
+
+    def done(self, pages):
+        with self.lock:
+            self.done_pages += pages
+
+    def get_text(self):
+        with self.lock:
+            elapsed = time.time() - self.start_time
+            pages_left = max(self.total_pages - self.done_pages, 0)
+            if self.done_pages == 0:
+                return 'Pages: %s/%s' % (self.done_pages, self.total_pages)
+            secs = pages_left * elapsed / self.done_pages
+            return 'Pages: %s/%s | %s seconds left | %s minutes left | %s hours left' % (
+                self.done_pages, self.total_pages, secs, secs / 60, secs / 3600)
@@ -0,0 +1,44 @@
+import threading
+
+from masters.data_structures.WorkUnit import WorkUnit
+
+
+def split_location(parent_url, start_page, last_page, shard_pages):
+    # Page ranges of shard_pages pages covering [start_page, last_page]
+    units = []
+    page = start_page
+    while page <= last_page:
+        end_page = min(page + shard_pages, last_page + 1)
+        units.append(WorkUnit(parent_url, page, end_page))
+        page = end_page
+    return units
+
+
+class ShardTracker(object):
+    # Counts unfinished work units of every location. Location is finished when all of its units are,
+    # and it is successful only when all of its units were. Reviews of shards are merged by review_id
+    # (primary key of the reviews table), so pages which shifted between shards are stored once.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.failed = set()
+        self.pages = {}
+
+    def add(self, parent_url, units=1):
+        with self.lock:
+            self.pending[parent_url] = self.pending.get(parent_url, 0) + units
+
+    def done(self, parent_url, status, pages):
+        # Returns None while location has unfinished units, otherwise (status, pages) of the whole location
+        with self.lock:
+            self.pending[parent_url] -= 1
+            self.pages[parent_url] = self.pages.get(parent_url, 0) + pages
+            if status != 0:
+                self.failed.add(parent_url)
+            if self.pending[parent_url] > 0:
+                return None
+            del self.pending[parent_url]
+            status = 1 if parent_url in self.failed else 0
+            self.failed.discard(parent_url)
+            return status, self.pages.pop(parent_url)
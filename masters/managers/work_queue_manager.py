@@ -0,0 +1,306 @@
+import argparse
+import itertools
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+from queue import PriorityQueue, Empty
+
+sys.path.append("..")
+
+from masters import settings
+from masters.data_structures.WorkUnit import WorkUnit
+from masters.managers import shard_manager
+
+BACKEND_LOCAL = "local"
+BACKEND_SQLITE = "sqlite"
+
+STATUS_PENDING = "pending"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+def get_owner(name):
+    # Unique id of one worker across all crawler nodes
+    return "%s:%s:%s" % (socket.gethostname(), os.getpid(), name)
+
+
+class LocalWorkQueue(object):
+    # In-memory queue of work units for a single process, longest job first.
+    # Leases never expire, units of a worker thread which died are completed as failed by its pool (get_leased).
+
+    def __init__(self, max_attempts=settings.WORK_QUEUE_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self.units = PriorityQueue()
+        self.sequence = itertools.count()
+        self.shards = shard_manager.ShardTracker()
+        self.lock = threading.Lock()
+        self.keys = set()
+        self.attempts = {}
+        # Key of every leased unit -> (owner, unit)
+        self.leases = {}
+
+    def put(self, unit):
+        # Returns False when the unit was already queued
+        with self.lock:
+            if unit.get_key() in self.keys:
+                return False
+            self.keys.add(unit.get_key())
+        self.shards.add(unit.parent_url)
+        self.units.put((-unit.get_cost(), next(self.sequence), unit))
+        return True
+
+    def lease(self, owner):
+        with self.lock:
+            try:
+                unit = self.units.get_nowait()[2]
+            except Empty:
+                return None
+            self.leases[unit.get_key()] = (owner, unit)
+            return unit
+
+    def get_leased(self, owner):
+        # Units leased by owner and not completed yet
+        with self.lock:
+            return [unit for unit_owner, unit in self.leases.values() if unit_owner == owner]
+
+    def heartbeat(self, owner, unit):
+        return True
+
+    def get_finished(self):
+        # Leases never expire, no location is finished by reclaim
+        return []
+
+    def complete(self, unit, owner, status, pages):
+        # Returns None while location has unfinished units, otherwise (status, pages) of the whole location
+        with self.lock:
+            if self.leases.get(unit.get_key(), (None,))[0] != owner:
+                # Unit was already completed (or released when its worker died)
+                return None
+            del self.leases[unit.get_key()]
+            attempts = self.attempts.get(unit.get_key(), 0) + 1
+            self.attempts[unit.get_key()] = attempts
+            if status != 0 and attempts < self.max_attempts:
+                self.units.put((-unit.get_cost(), next(self.sequence), unit))
+                return None
+        return self.shards.done(unit.parent_url, status, pages)
+
+    def is_drained(self):
+        with self.lock:
+            return not self.leases and self.units.empty()
+
+    def close(self):
+        pass
+
+
+class SQLiteWorkQueue(object):
+    # Durable queue of work units in an sqlite file, which can be shared by several crawler nodes.
+    # A leased unit belongs to its owner until lease_expires. Owners extend the lease with heartbeats,
+    # units of dead nodes are handed out again once their leases expire.
+
+    def __init__(self, db_file=settings.WORK_QUEUE_DB, lease_seconds=settings.WORK_QUEUE_LEASE,
+                 max_attempts=settings.WORK_QUEUE_MAX_ATTEMPTS, refresh_seconds=settings.WORK_QUEUE_REFRESH):
+        folder = os.path.dirname(db_file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+        # (parent_url, status, pages) of locations finished by reclaim, not reported yet
+        self.finished = []
+        # Transactions are started explicitly, BEGIN IMMEDIATE locks the file against other nodes
+        self.conn = sqlite3.connect(db_file, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute(""" CREATE TABLE IF NOT EXISTS work_units (
+                                key text,
+                                parent_url text,
+                                start_page integer,
+                                end_page integer,
+                                expected_pages integer,
+                                status text,
+                                owner text,
+                                lease_expires real,
+                                attempts integer,
+                                pages integer,
+                                created_at real,
+                                updated_at real,
+                                PRIMARY KEY (key)
+                            ); """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS work_units_status ON work_units(status, expected_pages)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS work_units_parent_url ON work_units(parent_url)")
+
+    def execute(self, function, *args):
+        # Runs function(*args) inside one write transaction
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = function(*args)
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def put(self, unit):
+        # Returns False when the unit is already in the queue (queued by another node or finished less than
+        # refresh_seconds ago)
+        return self.execute(self._put, unit)
+
+    def _put(self, unit):
+        now = time.time()
+        # Location finished in an earlier crawl is scraped anew, its old units (and shards) are removed
+        current = self.conn.execute("SELECT 1 FROM work_units WHERE parent_url = ? AND "
+                                    "(status NOT IN (?, ?) OR updated_at >= ?) LIMIT 1",
+                                    (unit.parent_url, STATUS_DONE, STATUS_FAILED, now - self.refresh_seconds)).fetchone()
+        if current is None:
+            self.conn.execute("DELETE FROM work_units WHERE parent_url = ?", (unit.parent_url,))
+        cursor = self.conn.execute(''' INSERT OR IGNORE INTO work_units(key, parent_url, start_page, end_page,
+                                            expected_pages, status, owner, lease_expires, attempts, pages,
+                                            created_at, updated_at)
+                                       VALUES(?,?,?,?,?,?,NULL,NULL,0,0,?,?) ''',
+                                   (unit.get_key(), unit.parent_url, unit.start_page, unit.end_page,
+                                    unit.get_cost(), STATUS_PENDING, now, now))
+        return cursor.rowcount > 0
+
+    def lease(self, owner):
+        return self.execute(self._lease, owner)
+
+    def _lease(self, owner):
+        now = time.time()
+        self.finished.extend(self.reclaim(now))
+        row = self.conn.execute(''' SELECT key, parent_url, start_page, end_page, expected_pages FROM work_units
+                                    WHERE status = ? ORDER BY expected_pages DESC, created_at LIMIT 1 ''',
+                                (STATUS_PENDING,)).fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE work_units SET status = ?, owner = ?, lease_expires = ?, updated_at = ? "
+                          "WHERE key = ?", (STATUS_LEASED, owner, now + self.lease_seconds, now, row[0]))
+        return WorkUnit(row[1], row[2], row[3], row[4])
+
+    def reclaim(self, now):
+        # Leases of dead owners go back to the queue as failed attempts, a unit which kills its node every time
+        # fails after max_attempts. Returns (parent_url, status, pages) of locations whose last unit failed.
+        failed_urls = [row[0] for row in self.conn.execute(
+            "SELECT DISTINCT parent_url FROM work_units WHERE status = ? AND lease_expires < ? AND attempts + 1 >= ?",
+            (STATUS_LEASED, now, self.max_attempts))]
+        self.conn.execute("UPDATE work_units SET status = CASE WHEN attempts + 1 < ? THEN ? ELSE ? END, owner = NULL, "
+                          "lease_expires = NULL, attempts = attempts + 1, updated_at = ? "
+                          "WHERE status = ? AND lease_expires < ?",
+                          (self.max_attempts, STATUS_PENDING, STATUS_FAILED, now, STATUS_LEASED, now))
+        finished = []
+        for parent_url in failed_urls:
+            result = self.get_location_result(parent_url)
+            if result is not None:
+                finished.append((parent_url,) + result)
+        return finished
+
+    def get_finished(self):
+        # Locations finished by reclaim since the last call, reported by the pool
+        with self.lock:
+            finished, self.finished = self.finished, []
+        return finished
+
+    def get_leased(self, owner):
+        # Units leased by owner and not completed yet
+        with self.lock:
+            rows = self.conn.execute("SELECT parent_url, start_page, end_page, expected_pages FROM work_units "
+                                     "WHERE status = ? AND owner = ?", (STATUS_LEASED, owner)).fetchall()
+        return [WorkUnit(*row) for row in rows]
+
+    def heartbeat(self, owner, unit):
+        # Returns False when the lease was lost (expired and handed out again)
+        return self.execute(self._heartbeat, owner, unit)
+
+    def _heartbeat(self, owner, unit):
+        cursor = self.conn.execute("UPDATE work_units SET lease_expires = ? WHERE key = ? AND status = ? AND owner = ?",
+                                   (time.time() + self.lease_seconds, unit.get_key(), STATUS_LEASED, owner))
+        return cursor.rowcount > 0
+
+    def complete(self, unit, owner, status, pages):
+        # Returns None while location has unfinished units, otherwise (status, pages) of the whole location.
+        # Exactly one node gets the result of a location, the one completing its last unit.
+        return self.execute(self._complete, unit, owner, status, pages)
+
+    def _complete(self, unit, owner, status, pages):
+        row = self.conn.execute("SELECT attempts FROM work_units WHERE key = ? AND status = ? AND owner = ?",
+                                (unit.get_key(), STATUS_LEASED, owner)).fetchone()
+        if row is None:
+            # Lease was lost, the unit is some other worker's now
+            return None
+        attempts = row[0] + 1
+        if status == 0:
+            new_status = STATUS_DONE
+        elif attempts < self.max_attempts:
+            new_status = STATUS_PENDING
+        else:
+            new_status = STATUS_FAILED
+        self.conn.execute("UPDATE work_units SET status = ?, owner = NULL, lease_expires = NULL, attempts = ?, "
+                          "pages = pages + ?, updated_at = ? WHERE key = ?",
+                          (new_status, attempts, pages, time.time(), unit.get_key()))
+        if new_status == STATUS_PENDING:
+            return None
+        return self.get_location_result(unit.parent_url)
+
+    def get_location_result(self, parent_url):
+        # (status, pages) of a location whose units are all done or failed, None otherwise
+        unfinished, failed, location_pages = self.conn.execute(
+            "SELECT SUM(status NOT IN (?, ?)), SUM(status = ?), SUM(pages) FROM work_units WHERE parent_url = ?",
+            (STATUS_DONE, STATUS_FAILED, STATUS_FAILED, parent_url)).fetchone()
+        if unfinished > 0:
+            return None
+        return 1 if failed > 0 else 0, location_pages
+
+    def is_drained(self):
+        # Nothing to lease and nothing leased, which could still be split or reclaimed
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM work_units WHERE status IN (?, ?) LIMIT 1",
+                                    (STATUS_PENDING, STATUS_LEASED)).fetchone()
+        return row is None
+
+    def get_counts(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM work_units GROUP BY status").fetchall())
+
+    def requeue_failed(self):
+        return self.execute(lambda: self.conn.execute(
+            "UPDATE work_units SET status = ?, attempts = 0 WHERE status = ?",
+            (STATUS_PENDING, STATUS_FAILED)).rowcount)
+
+    def clear(self):
+        self.execute(lambda: self.conn.execute("DELETE FROM work_units"))
+
+    def close(self):
+        self.conn.close()
+
+
+def get_work_queue(backend=settings.WORK_QUEUE_BACKEND):
+    if backend == BACKEND_LOCAL:
+        return LocalWorkQueue()
+    if backend == BACKEND_SQLITE:
+        return SQLiteWorkQueue()
+    raise ValueError("Unknown WORK_QUEUE_BACKEND: %s" % backend)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or change the shared work queue (WORK_QUEUE_DB)")
+    parser.add_argument("command", choices=["status", "requeue-failed", "clear"])
+    args = parser.parse_args()
+
+    queue = SQLiteWorkQueue()
+    if args.command == "status":
+        for status, count in sorted(queue.get_counts().items()):
+            print("%s: %s" % (status, count))
+    elif args.command == "requeue-failed":
+        print("Requeued %s units" % queue.requeue_failed())
+    else:
+        queue.clear()
+        print("Removed all units")
+    queue.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,12 @@
 # http://doc.scrapy.org/en/latest/topics/spider-middleware.html
 
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request, TextResponse
+
+from masters import httpcache
+from masters.items import FetchedPageItem
+from masters.managers import fingerprint_manager
 
 
 class MastersSpiderMiddleware(object):
@@ -54,3 +60,157 @@ class MastersSpiderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class FetchedPageMiddleware(object):
+    # Adds FetchedPageItem after everything the spider returned for a downloaded page, DatabasePipeline marks
+    # the page in FINGERPRINT_FILTER_FILE once its rows are committed. Pages whose callback failed, which the spider
+    # requested again (bad page, "Retrying") or which stayed soft blocked stay unmarked.
+
+    def __init__(self):
+        if fingerprint_manager.get_fingerprints() is None:
+            raise NotConfigured
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if httpcache.is_replay(crawler.settings):
+            fingerprint_manager.disable()
+        return cls()
+
+    def process_spider_output(self, response, result, spider):
+        fingerprint = self.get_fingerprint(response.request)
+        retried = False
+        for i in result:
+            retried = retried or self.is_retry(i, fingerprint)
+            yield i
+        if self.is_fetched(response, retried):
+            yield FetchedPageItem(fingerprint=fingerprint)
+
+    async def process_spider_output_async(self, response, result, spider):
+        # Same for spiders and middlewares with asynchronous output (newer scrapy)
+        fingerprint = self.get_fingerprint(response.request)
+        retried = False
+        async for i in result:
+            retried = retried or self.is_retry(i, fingerprint)
+            yield i
+        if self.is_fetched(response, retried):
+            yield FetchedPageItem(fingerprint=fingerprint)
+
+    def is_retry(self, output, fingerprint):
+        return isinstance(output, Request) and self.get_fingerprint(output) == fingerprint
+
+    def is_fetched(self, response, retried):
+        return response.status == 200 and not retried and not response.meta.get('adaptive_throttle_soft_blocked')
+
+    @staticmethod
+    def get_fingerprint(request):
+        return fingerprint_manager.get_fingerprint(request.url, request.method, request.body)
+
+
+class HostThrottleState(object):
+    def __init__(self, delay, concurrency):
+        self.delay = delay
+        self.concurrency = concurrency
+        self.latency = None
+        self.error_rate = 0.0
+        self.soft_blocks = 0
+
+
+class AdaptiveThrottleMiddleware(object):
+    # Downloader middleware which sets delay and concurrency of every download slot (host) with AIMD:
+    # fast successful responses add concurrency and take away delay step by step,
+    # errors and soft-blocked pages (200 page without the expected content) cut concurrency and double delay.
+    # Soft-blocked pages are retried a few times after the slot was slowed down.
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.start_delay = settings.getfloat('ADAPTIVE_THROTTLE_START_DELAY', settings.getfloat('DOWNLOAD_DELAY'))
+        self.min_delay = settings.getfloat('ADAPTIVE_THROTTLE_MIN_DELAY')
+        self.max_delay = settings.getfloat('ADAPTIVE_THROTTLE_MAX_DELAY')
+        self.delay_step = settings.getfloat('ADAPTIVE_THROTTLE_DELAY_STEP')
+        self.start_concurrency = settings.getint('ADAPTIVE_THROTTLE_START_CONCURRENCY')
+        self.min_concurrency = settings.getint('ADAPTIVE_THROTTLE_MIN_CONCURRENCY')
+        self.max_concurrency = settings.getint('ADAPTIVE_THROTTLE_MAX_CONCURRENCY')
+        self.decrease_factor = settings.getfloat('ADAPTIVE_THROTTLE_DECREASE_FACTOR')
+        self.target_latency = settings.getfloat('ADAPTIVE_THROTTLE_TARGET_LATENCY')
+        self.block_codes = set(int(code) for code in settings.getlist('ADAPTIVE_THROTTLE_BLOCK_CODES'))
+        self.max_retries = settings.getint('ADAPTIVE_THROTTLE_MAX_RETRIES')
+        self.soft_block_selectors = settings.getdict('ADAPTIVE_THROTTLE_SOFT_BLOCK_SELECTORS')
+        self.hosts = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_response(self, request, response, spider):
+        key, state = self.get_state(request)
+        if response.status in self.block_codes:
+            self.decrease(key, state)
+            return response
+        if self.is_soft_blocked(response, spider):
+            state.soft_blocks += 1
+            self.stats.inc_value('adaptive_throttle/soft_blocks')
+            self.decrease(key, state)
+            retries = request.meta.get('adaptive_throttle_retries', 0)
+            if retries < self.max_retries:
+                spider.logger.info('Soft block on %s, retrying (%s)' % (response.url, retries + 1))
+                retry = request.replace(dont_filter=True)
+                retry.meta['adaptive_throttle_retries'] = retries + 1
+                return retry
+            # Page is passed to the spider, but not marked as downloaded (FetchedPageMiddleware)
+            request.meta['adaptive_throttle_soft_blocked'] = True
+            return response
+        self.increase(key, state, request.meta.get('download_latency'))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        key, state = self.get_state(request)
+        self.decrease(key, state)
+
+    def is_soft_blocked(self, response, spider):
+        selectors = self.soft_block_selectors.get(spider.name)
+        if not selectors or response.status != 200 or not isinstance(response, TextResponse):
+            return False
+        if not response.url.startswith('http'):
+            return False
+        for selector in selectors:
+            if response.css(selector):
+                return False
+        return True
+
+    def get_state(self, request):
+        key = request.meta.get('download_slot')
+        if key not in self.hosts:
+            self.hosts[key] = HostThrottleState(self.start_delay, self.start_concurrency)
+        return key, self.hosts[key]
+
+    def increase(self, key, state, latency):
+        state.error_rate *= 0.9
+        if latency is not None:
+            state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+        if state.latency is None or state.latency <= self.target_latency:
+            state.concurrency = min(self.max_concurrency, state.concurrency + 1)
+            state.delay = max(self.min_delay, state.delay - self.delay_step)
+        self.apply(key, state)
+
+    def decrease(self, key, state):
+        state.error_rate = 0.9 * state.error_rate + 0.1
+        state.concurrency = max(self.min_concurrency, int(state.concurrency * self.decrease_factor))
+        state.delay = min(self.max_delay, max(state.delay * 2, self.delay_step))
+        self.apply(key, state)
+
+    def apply(self, key, state):
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            slot.delay = state.delay
+            slot.concurrency = state.concurrency
+        prefix = 'adaptive_throttle/%s/' % key
+        self.stats.set_value(prefix + 'delay', state.delay)
+        self.stats.set_value(prefix + 'concurrency', state.concurrency)
+        self.stats.set_value(prefix + 'latency', state.latency)
+        self.stats.set_value(prefix + 'error_rate', state.error_rate)
+        self.stats.set_value(prefix + 'soft_blocks', state.soft_blocks)
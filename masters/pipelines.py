@@ -5,7 +5,45 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: http://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
+from masters.data_managers.utils.database_partitions import PartitionedSink
+from masters.data_managers.utils.database_sink import DatabaseSink
+from masters.items import DatabaseItem, FetchedPageItem
+
+
+class DatabasePipeline(object):
+    # Writes province, location and review items to DATABASE in batches of DATABASE_BATCH rows,
+    # or to the partitions of COUNTRY in DATABASE_PARTITIONS when DATABASE_PARTITIONED
+
+    def __init__(self, db_file, batch_size, partitions=None, country=None, years=False):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.partitions = partitions
+        self.country = country
+        self.years = years
+        self.sink = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if settings.getbool('DATABASE_PARTITIONED'):
+            return cls(settings.get('DATABASE_PARTITIONS'), settings.getint('DATABASE_BATCH', 1000),
+                       settings.get('DATABASE_PARTITIONS'), settings.get('COUNTRY'),
+                       settings.getbool('DATABASE_PARTITION_YEARS'))
+        return cls(settings.get('DATABASE'), settings.getint('DATABASE_BATCH', 1000))
+
+    def open_spider(self, spider):
+        if self.partitions:
+            self.sink = PartitionedSink(self.country, self.partitions, self.batch_size, self.years)
+        else:
+            self.sink = DatabaseSink(self.db_file, self.batch_size)
+
+    def close_spider(self, spider):
+        self.sink.close()
+        spider.logger.info("Written %s rows to %s" % (self.sink.written, self.db_file))
 
-class MastersPipeline(object):
     def process_item(self, item, spider):
+        if isinstance(item, DatabaseItem):
+            self.sink.add(item.table, item.get_row())
+        elif isinstance(item, FetchedPageItem):
+            self.sink.mark_fetched(item['fingerprint'])
         return item
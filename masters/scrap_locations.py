@@ -1,67 +1,42 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import os
-import time
 
-from os import listdir
+sys.path.append("..")
+
 from scrapy import cmdline
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from masters.data_managers.utils import database_queries
+from masters.spiders.locations_spider import LocationsSpider
 from masters.utils.file_utils import location_scraped
 from masters.utils.logger_utils import Logger
 from masters import settings
 
-sys.path.append("..")
-
 print("Scraper started...")
 
-root = "scraped_data/data_provinces/" + settings.COUNTRY
-
-# Get numbers of locations to scrap
-ulrs = 0
-for province in listdir(root):
-    f = open(root + "/" + province, "r")
-    while True:
-        location = f.readline()
-        ulrs += 1
-        if not location:
-            f.close()
-            break
-f = open("logs/scraped_locations.log", "r")
-scraped_num = 0
-while True:
-    location = f.readline()
-    scraped_num += 1
-    if not location:
-        f.close()
-        break
-
-avg_time = 3
-seconds_left = (ulrs - scraped_num) * avg_time
-time_stamp = time.time()
-for province in listdir(root):
-    f = open(root + "/" + province, 'r')
-    while True:
-        location = f.readline()
-        scraped_num += 1
-        print("Line: " + location)
-        if not location:
-            break
-        location = location.rstrip().split(", ")[2]
-        if location == "province_url":
-            continue
-        if not location_scraped(location):
-            time_stamp = time.time()
-            Logger.log_time("######### Time left: seconds %s | minutes %s | hours %s" % (
-                seconds_left, seconds_left / 60, seconds_left / 60 / 60))
-
-            command = "scrapy crawl locations -a province=" + location
-            os.system(command)
-
-            avg_time = time.time() - time_stamp
-            seconds_left = (ulrs - scraped_num) * avg_time
-            Logger.log_location(location)
-        else:
-            print("Location already scraped: " + location)
+# Collect all provinces of the country (written to the database by the provinces spider) which were not scraped yet
+provinces = []
+for province in database_queries.iter_provinces(settings.COUNTRY):
+    if not province.province_url:
+        continue
+    if location_scraped(province.province_url):
+        print("Location already scraped: " + province.province_url)
+        continue
+    provinces.append(province.province_url)
+database_queries.close_connections()
+
+Logger.log_time("######### Provinces to scrap: %s" % len(provinces))
+
+# All provinces are crawled by one LocationsSpider inside one process, so they share
+# one reactor, one connection pool and one set of settings
+crawler_settings = get_project_settings()
+crawler_settings.set('CONCURRENT_REQUESTS', settings.LOCATIONS_CONCURRENT_REQUESTS)
+crawler_settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', settings.LOCATIONS_CONCURRENT_REQUESTS)
+
+process = CrawlerProcess(crawler_settings)
+process.crawl(LocationsSpider, provinces=provinces)
+process.start()
 #
 # cmdline.execute("scrapy crawl locations -a province=/Attractions-g312722-Activities-Koper_Slovenian_Istria_Slovenian_Littoral_Region.html".split())
 # cmdline.execute("scrapy crawl locations -a province=/Attractions-g1816350-Activities-Yaremche_Ivano_Frankivsk_Oblast.html".split())
@@ -70,4 +45,4 @@ for province in listdir(root):
 # cmdline.execute("scrapy crawl locations -a province=".split())
 # cmdline.execute("scrapy crawl locations -a province=".split())
 # cmdline.execute("scrapy crawl locations -a province=".split())
-# cmdline.execute("scrapy crawl locations -a province=".split())
\ No newline at end of file
+# cmdline.execute("scrapy crawl locations -a province=".split())
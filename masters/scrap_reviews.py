@@ -7,9 +7,11 @@ sys.path.append("..")
 
 import masters
 from scrapy import cmdline
-from masters.utils.logger_utils import Logger
-from masters.utils.file_utils import location_scraped, location_overkill
+from masters import settings
+from masters.utils.file_utils import location_scraped
 from masters.data_managers.utils import database_utils
+from masters.gecko_spiders.gecko_pool import GeckoWorkerPool
+from masters.managers import schedule_manager
 
 # print("Scraper started...")
 # # location_url = "/Attraction_Review-g7060164-d9756222-Reviews-Tri_Karasya_Fishing_and_Recreation_Complex-Bilyayivka_Odessa_Oblast.html"
@@ -19,50 +21,34 @@ from masters.data_managers.utils import database_utils
 # #
 # exit(0)
 
-connection = database_utils.create_connection("data/databases/data.db")
+connection = database_utils.create_data_connection([settings.COUNTRY], reviews=False)
 locations = database_utils.get_location_urls(connection)
 
-f = open("logs/scraped_locations.log", "r")
-scraped_num = -1
-while True:
-    location = f.readline()
-    scraped_num += 1
-    if not location:
-        f.close()
-        break
-
-amount_of_locations = len(locations)
-pages_left = amount_of_locations - scraped_num
-start_time = time.time()
-scraped_in_this_run = 0
-
+# Locations are scraped by a pool of long-lived browsers instead of one
+# gecko_runner.py process (and one cold firefox) per location.
+# With WORK_QUEUE_BACKEND = "sqlite" this script can run on several nodes sharing WORK_QUEUE_DB,
+# locations are queued once and every node leases work from the same queue.
+pool = GeckoWorkerPool(settings.GECKO_WORKERS)
+location_urls = []
 for location in locations:
-    location_url = location[7]
-    is_scraped = location_scraped(location_url)
-    is_overkill = location_overkill(location_url)
-    if not location_url or location_url == "attraction_url" or is_scraped or is_overkill:
-        if is_overkill:
-            print("Location overkill: " + location_url)
-            continue
-        if location_scraped:
-            print("Location already scraped: " + location_url)
-            continue
-
-    time_stamp = time.time()
-    if scraped_in_this_run == 0:
-        average_time = 0
-    else:
-        average_time = (time.time() - start_time) / scraped_in_this_run
-    seconds_left = (pages_left - scraped_in_this_run) * average_time
-    secs = seconds_left
-    mins = seconds_left / 60
-    hours = seconds_left / 3600
-    Logger.log_it('Locations: %s/%s | %s seconds left | %s minutes left | %s hours left' % (
-        (scraped_num + scraped_in_this_run), amount_of_locations, secs, mins, hours))
-
+    location_url = location[0]
+    if not location_url:
+        continue
+    if location_scraped(location_url) and not settings.REVIEWS_INCREMENTAL:
+        print("Location already scraped: " + location_url)
+        continue
     # os.system("scrapy crawl reviews -a location=" + location_url)
-    status = os.system("python3 gecko_runner.py " + location_url)
-    if status == 0:
-        Logger.log_location(location_url)
-    scraped_in_this_run += 1
-    # pages_left -= 1
+    # os.system("python3 gecko_runner.py " + location_url)
+    location_urls.append(location_url)
+
+# Biggest locations first, so the crawl doesn't end with one worker busy on a huge location
+expected_pages = schedule_manager.get_expected_pages(location_urls, [settings.COUNTRY])
+queued = 0
+for location_url in schedule_manager.order_by_cost(location_urls, expected_pages):
+    if pool.add_location(location_url, expected_pages[location_url]):
+        queued += 1
+print("Scheduled %s locations (%s already queued), %s expected pages" % (
+    queued, len(location_urls) - queued, sum(expected_pages.values())))
+
+pool.start()
+pool.join()
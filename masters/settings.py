@@ -49,6 +49,7 @@ DOWNLOAD_DELAY = 0.1
 # See http://scrapy.readthedocs.org/en/latest/topics/spider-middleware.html
 SPIDER_MIDDLEWARES = {
     'scrapy_splash.SplashDeduplicateArgsMiddleware': 100,
+    'masters.middlewares.FetchedPageMiddleware': 950,
 }
 
 # Enable or disable downloader middlewares
@@ -57,12 +58,18 @@ DOWNLOADER_MIDDLEWARES = {
     'scrapy_splash.SplashCookiesMiddleware': 723,
     'scrapy_splash.SplashMiddleware': 725,
     'scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware': 810,
+    'masters.middlewares.AdaptiveThrottleMiddleware': 800,
 }
 
 # DUPEFILTER_CLASS = 'scrapy_splash.SplashAwareDupeFilter'
-DUPEFILTER_CLASS = 'scrapy.dupefilters.BaseDupeFilter'
+# DUPEFILTER_CLASS = 'scrapy.dupefilters.BaseDupeFilter'
+DUPEFILTER_CLASS = 'masters.dupefilters.FingerprintDupeFilter'
 
-HTTPCACHE_STORAGE = 'scrapy_splash.SplashAwareFSCacheStorage'
+# Content addressed record/replay cache (see httpcache.py), enable with -s HTTPCACHE_ENABLED=1
+HTTPCACHE_STORAGE = 'masters.httpcache.ContentAddressedCacheStorage'
+HTTPCACHE_DIR = 'httpcache'
+HTTPCACHE_MODE = 'record'  # record|replay
+HTTPCACHE_GZIP_LEVEL = 6
 
 # Enable or disable extensions
 # See http://scrapy.readthedocs.org/en/latest/topics/extensions.html
@@ -72,9 +79,9 @@ HTTPCACHE_STORAGE = 'scrapy_splash.SplashAwareFSCacheStorage'
 
 # Configure item pipelines
 # See http://scrapy.readthedocs.org/en/latest/topics/item-pipeline.html
-# ITEM_PIPELINES = {
-#    'masters.pipelines.MastersPipeline': 300,
-# }
+ITEM_PIPELINES = {
+    'masters.pipelines.DatabasePipeline': 300,
+}
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See http://doc.scrapy.org/en/latest/topics/autothrottle.html
@@ -89,6 +96,29 @@ AUTOTHROTTLE_MAX_DELAY = 10
 # Enable showing throttling stats for every response received:
 # AUTOTHROTTLE_DEBUG = False
 
+# Adaptive throttle (masters.middlewares.AdaptiveThrottleMiddleware) sets delay and concurrency
+# per host from observed latency, errors and soft-blocked pages. Current limits are in stats.
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_START_DELAY = DOWNLOAD_DELAY
+ADAPTIVE_THROTTLE_MIN_DELAY = 0
+ADAPTIVE_THROTTLE_MAX_DELAY = 10
+ADAPTIVE_THROTTLE_DELAY_STEP = 0.05
+ADAPTIVE_THROTTLE_START_CONCURRENCY = 4
+ADAPTIVE_THROTTLE_MIN_CONCURRENCY = 1
+ADAPTIVE_THROTTLE_MAX_CONCURRENCY = 16
+ADAPTIVE_THROTTLE_DECREASE_FACTOR = 0.5
+# Average latency (seconds) above which concurrency is not increased anymore
+ADAPTIVE_THROTTLE_TARGET_LATENCY = 2.0
+ADAPTIVE_THROTTLE_BLOCK_CODES = [403, 429, 503]
+# Soft-blocked pages are retried this many times before they are passed to the spider
+ADAPTIVE_THROTTLE_MAX_RETRIES = 3
+# Page is soft-blocked when none of the spider's selectors matches
+ADAPTIVE_THROTTLE_SOFT_BLOCK_SELECTORS = {
+    'reviews': ['h1.ui_header', 'h1._3QHreJVJ', 'div.b2oaw8yU'],
+    'locations': ['div._1r6YXRQy', 'div.pageNumbers', 'div._2j03JUe9', 'div.k8UcErpq', 'div._25PvF8uO'],
+    'provinces': ['ul.geoList', 'div.pgLinks'],
+}
+
 # Enable and configure HTTP caching (disabled by default)
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 # HTTPCACHE_ENABLED = True
@@ -102,5 +132,81 @@ AUTOTHROTTLE_MAX_DELAY = 10
 # Custom settings
 HEADLESS_MODE = False
 COUNTRY = "ita"  # aus|cro|hun|ita|slo|ukr
+# Names of the countries in the database (provinces.country)
+COUNTRY_NAMES = {
+    "aus": "austria",
+    "cro": "croatia",
+    "hun": "hungary",
+    "ita": "italy",
+    "slo": "slovenia",
+    "ukr": "ukraine",
+}
+
+# Concurrent requests used by scrap_locations.py, which crawls all provinces inside one process
+LOCATIONS_CONCURRENT_REQUESTS = 16
+
+# Number of firefox workers used by scrap_reviews.py
+GECKO_WORKERS = 2
+# Restart a worker's firefox after it scraped this many pages or exceeded this much memory (MB).
+# Inside a big location the new browser continues at the next review page.
+GECKO_RECYCLE_PAGES = 500
+GECKO_RECYCLE_MEMORY = 1500
+# Locations with more review pages are split into shards of this many pages scraped by different workers (0 - off)
+GECKO_SHARD_PAGES = 200
+# Work queue of the gecko worker pool: "local" (in-memory, one process) or "sqlite" (WORK_QUEUE_DB, which can be
+# on storage shared by several crawler nodes). Leased units are handed out again when their owner stops sending
+# heartbeats for WORK_QUEUE_LEASE seconds, failed units are retried until they were tried WORK_QUEUE_MAX_ATTEMPTS times.
+WORK_QUEUE_BACKEND = "local"
+WORK_QUEUE_DB = "data/databases/work_queue.db"
+WORK_QUEUE_LEASE = 300
+WORK_QUEUE_MAX_ATTEMPTS = 1
+# Locations whose units all finished (done or failed) more than this many seconds ago belong to an earlier crawl,
+# queueing them again starts them anew (incremental refresh, reruns). Newer ones are taken as done by another node.
+WORK_QUEUE_REFRESH = 12 * 3600
+# Seconds an idle worker waits before asking again while other workers may still add shards
+WORK_QUEUE_POLL = 5
+# Locations without known page count are expected to have this many pages, or are probed first if SCHEDULE_PROBE
+SCHEDULE_DEFAULT_PAGES = 1
+SCHEDULE_PROBE = False
+# Gecko spider opens next review page by its -Reviews-orNNN- url instead of clicking on pagination
+GECKO_URL_NAVIGATION = True
+# Maximum seconds a gecko spider waits for a page condition and how often it checks it
+GECKO_WAIT_TIMEOUT = 10
+GECKO_WAIT_POLL = 0.05
+
+# Number of reviews on one review page (-Reviews-orNNN- offset step)
+REVIEWS_PAGE_SIZE = 5
+# Request all review pages of a location as soon as the first page is parsed instead of following next links
+REVIEWS_FANOUT = False
+# Maximum number of review pages of one location which are requested at the same time in fanout mode
+REVIEWS_LOCATION_CONCURRENCY = 8
+
+# Incremental refresh: review pagination of a location stops at the first page with only known review ids
+REVIEWS_INCREMENTAL = False
+
+DATABASE = "data/databases/data.db"
+# Scraped provinces, locations and reviews are written to DATABASE in transactions of this many rows
+DATABASE_BATCH = 1000
+# Spiders also write one csv file per scraped page to scraped_data/
+CSV_OUTPUT = False
+# Every country is written to its own database in DATABASE_PARTITIONS instead of DATABASE, so countries can be
+# scraped and loaded in parallel. With DATABASE_PARTITION_YEARS reviews of every year get their own database.
+# Partitions are read together with database_utils.create_partitioned_connection.
+DATABASE_PARTITIONED = False
+DATABASE_PARTITIONS = "data/databases/partitions"
+DATABASE_PARTITION_YEARS = False
+
+# Sqlite database holding the status of every scraped province and location
+CRAWL_STATE_DB = "data/databases/crawl_state.db"
+# Number of status updates which are buffered before they are written
+CRAWL_STATE_BATCH = 100
+
+# Bloom filter file with fingerprints of downloaded pages, shared by scrapy spiders and gecko workers.
+# Pages downloaded before are not requested again after a restart (None - off). The filter keeps the size
+# it was created with, at most FINGERPRINT_FILTER_ERROR_RATE of not downloaded pages are taken as downloaded
+# while it holds up to FINGERPRINT_FILTER_CAPACITY pages.
+FINGERPRINT_FILTER_FILE = "data/databases/fingerprints.bloom"
+FINGERPRINT_FILTER_CAPACITY = 10000000
+FINGERPRINT_FILTER_ERROR_RATE = 0.001
 
 SPLASH_URL = 'http://192.168.99.100:8050'
@@ -4,35 +4,101 @@ import re
 import json
 
 from masters.data_structures.Attraction import Attraction
-from masters.utils import unicode_utils
+from masters.items import LocationItem
+from masters.utils import unicode_utils, url_utils
+from masters.utils.logger_utils import Logger
+from masters.managers import crawl_state_manager
+from masters.managers import fingerprint_manager
 from masters import settings
 
 
 class LocationsSpider(scrapy.Spider):
     name = "locations"
     root_url = 'https://www.tripadvisor.co.uk'
-    urls = []
+    page_size = 30
 
-    def __init__(self, province='', **kwargs):
+    def __init__(self, province='', provinces=None, **kwargs):
+        # provinces: list of province urls (or comma separated string when passed with -a) which are all crawled
+        # inside this single spider run, so they share one reactor and one connection pool
         self.parent_url = province
         self.start_time = time.time()
-        self.urls.append(province)
+        self.urls = []
+        if province:
+            self.urls.append(province)
+        if provinces:
+            if isinstance(provinces, str):
+                provinces = provinces.split(",")
+            self.urls.extend(provinces)
+        self.provinces_total = len(self.urls)
+        self.provinces_done = 0
         self.scraped_pages = 0
+        self.scheduled = set()
+        self.pages_left = {}
         super(LocationsSpider, self).__init__(**kwargs)
 
-    def request(self, url, callback):
+    def request(self, url, callback, parent_url=None, dont_filter=False, errback=None):
+        if parent_url is None:
+            parent_url = url
         request_with_cookies = scrapy.Request(
             url=(self.root_url + url),
-            callback=callback)
+            callback=callback,
+            errback=errback,
+            meta={'parent_url': parent_url},
+            dont_filter=dont_filter)
         return request_with_cookies
 
     def start_requests(self):
         while self.urls.__len__() > 0:
             url = self.urls.pop()
-            yield self.request(url, self.parse)
+            # First page is always downloaded, it tells how many pages the province has
+            for request in self.schedule(url, url, dont_filter=True):
+                yield request
+
+    def schedule(self, url, parent_url, dont_filter=False):
+        # Every listing page is requested once, whether it came from fanout or from the next link
+        key = url_utils.strip_fragment(url)
+        if key in self.scheduled:
+            return
+        self.scheduled.add(key)
+        yield self.request(url, self.parse, parent_url, dont_filter, errback=self.page_failed)
+
+    def page_failed(self, failure):
+        # Page failed after retries, it still counts so the province can finish
+        parent_url = failure.request.meta['parent_url']
+        self.logger.error("Listing page %s failed: %s" % (failure.request.url, repr(failure.value)))
+        if parent_url not in self.pages_left:
+            return
+        if url_utils.strip_fragment(failure.request.url) != url_utils.strip_fragment(self.root_url + parent_url):
+            self.pages_left[parent_url] -= 1
+        if self.pages_left[parent_url] <= 0:
+            del self.pages_left[parent_url]
+            self.province_done(parent_url)
+
+    def fanout(self, parent_url, last_page):
+        # Enqueue all remaining listing pages as soon as the first page tells the last page number.
+        # Pages downloaded before a restart are already saved and count as done.
+        self.pages_left[parent_url] = last_page - 1
+        for page in range(2, last_page + 1):
+            url = url_utils.get_listing_page_url(parent_url, (page - 1) * self.page_size)
+            if fingerprint_manager.is_fetched(self.root_url + url):
+                self.scheduled.add(url_utils.strip_fragment(url))
+                self.pages_left[parent_url] -= 1
+                continue
+            for request in self.schedule(url, parent_url):
+                yield request
+
+    def province_done(self, parent_url):
+        self.provinces_done += 1
+        Logger.log_location(parent_url)
+        crawl_state_manager.mark_done(parent_url)
+        average_time = (time.time() - self.start_time) / self.provinces_done
+        seconds_left = (self.provinces_total - self.provinces_done) * average_time
+        Logger.log_time("######### Provinces: %s/%s | Time left: seconds %s | minutes %s | hours %s" % (
+            self.provinces_done, self.provinces_total, seconds_left, seconds_left / 60, seconds_left / 60 / 60))
 
     def parse(self, response):
         self.scraped_pages = self.scraped_pages + 1
+        parent_url = response.meta['parent_url']
         attractions_obj = []
         attractions = response.css('div._2j03JUe9.MmIH_ltD._2JdZspdU')
 
@@ -70,7 +136,7 @@ class LocationsSpider(scrapy.Spider):
                     attraction.css('a._3W3bcspL::attr(href)').extract_first())
 
             attraction_obj = Attraction(attraction_name, attraction_rate, attraction_type, attraction_url,
-                                        self.parent_url)
+                                        parent_url)
             attractions_obj.append(attraction_obj)
 
         if attractions is None or len(attractions) == 0:
@@ -88,7 +154,7 @@ class LocationsSpider(scrapy.Spider):
                 attraction_url = unicode_utils.unicode_to_string(
                     attraction.css('div._6sUF3jUd a._1QKQOve4::attr(href)').extract_first())
                 attraction_obj = Attraction(attraction_name, attraction_rate, attraction_type, attraction_url,
-                                            self.parent_url)
+                                            parent_url)
                 attractions_obj.append(attraction_obj)
 
         location_group_name = response.url.replace(".html", "").split("-Activities-")[1]
@@ -114,7 +180,8 @@ class LocationsSpider(scrapy.Spider):
                 if current_page is not None:
                     current_url = response.url.replace(self.root_url, "")
                     print("Retrying(1) " + current_url)
-                    yield self.request(current_url, self.parse)
+                    yield self.request(current_url, self.parse, parent_url, dont_filter=True,
+                                       errback=response.request.errback)
                     return
 
         elif last_page is not None and len(last_page) > 0:
@@ -127,20 +194,24 @@ class LocationsSpider(scrapy.Spider):
             self.log("Fail to convert pages: %s %s" % (last_page, current_page))
 
         if next_page is None and current_page is not None and current_page < last_page:
-            next_page = self.parent_url.split("-Activities-")
-            pagination = int(current_page) * 30
+            next_page = parent_url.split("-Activities-")
+            pagination = int(current_page) * self.page_size
             next_page = next_page[0] + "-Activities-" + "oa" + str(pagination) + "-" + next_page[1]
             if current_page == last_page:
                 next_page = None
 
-        filename = 'scraped_data/data_locations/%s/locations-%s-%s.csv' % (
-            settings.COUNTRY, location_group_name, current_page)
-        with open(filename, 'w') as f:
-            f.write(Attraction.get_csv_header())
-            for attraction in attractions_obj:
-                f.write(attraction.get_csv_line())
-            f.close()
-        self.log('Saved %s locations in file %s' % (len(attractions_obj), filename))
+        for attraction in attractions_obj:
+            yield LocationItem.from_row(attraction.get_db_row())
+
+        if settings.CSV_OUTPUT:
+            filename = 'scraped_data/data_locations/%s/locations-%s-%s.csv' % (
+                settings.COUNTRY, location_group_name, current_page)
+            with open(filename, 'w') as f:
+                f.write(Attraction.get_csv_header())
+                for attraction in attractions_obj:
+                    f.write(attraction.get_csv_line())
+                f.close()
+            self.log('Saved %s locations in file %s' % (len(attractions_obj), filename))
 
         try:
             current_time = time.time()
@@ -154,8 +225,21 @@ class LocationsSpider(scrapy.Spider):
         except:
             self.log('Locations: %s/%s' % (current_page, last_page))
 
+        if current_page == 1 and isinstance(last_page, int) and last_page > 1 and parent_url not in self.pages_left:
+            for request in self.fanout(parent_url, last_page):
+                yield request
         if next_page is not None:
-            yield self.request(next_page, self.parse)
+            for request in self.schedule(next_page, parent_url):
+                yield request
+
+        if parent_url in self.pages_left:
+            if current_page != 1:
+                self.pages_left[parent_url] -= 1
+            if self.pages_left[parent_url] <= 0:
+                del self.pages_left[parent_url]
+                self.province_done(parent_url)
+        elif next_page is None:
+            self.province_done(parent_url)
 
         # pattern = re.compile(r'(?<=pageManifest:)(.*)(?=}\;\(this\.)')
         # pattern = re.compile(r'(?<=JSON\.parse\(\")(.*)(?=\"\)\)\);)')
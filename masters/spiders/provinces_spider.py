@@ -10,7 +10,8 @@ import time
 import pathlib
 
 from masters.data_structures.Province import Province
-from masters.utils import unicode_utils, file_utils
+from masters.items import ProvinceItem
+from masters.utils import unicode_utils, file_utils, url_utils
 from masters import settings
 from os import listdir
 
@@ -18,16 +19,21 @@ from os import listdir
 class ProvincesSpider(scrapy.Spider):
     name = "provinces"
     root_url = 'https://www.tripadvisor.com'
-    urls = []
+    # Second page starts at oa20, every next page adds 50 provinces (oa70, oa120, ...)
+    first_offset = 20
+    page_size = 50
+    # The missing_data files are read after the last listing page, so every page has to be parsed
+    skip_fetched_pages = False
 
     def __init__(self, country='', **kwargs):
         print(country)
         self.extra_data_pages = -1
-        self.extra_data = False
         self.parent_url = country
         self.start_time = time.time()
-        self.urls.append(country)
+        self.urls = [country]
         self.scraped_pages = 0
+        self.scheduled = set()
+        self.fanout_done = False
         super(ProvincesSpider, self).__init__(**kwargs)
 
     def request(self, url, callback):
@@ -40,16 +46,36 @@ class ProvincesSpider(scrapy.Spider):
         base_url = str(pathlib.Path().absolute())
         request_with_cookies = scrapy.Request(
             url=("file://" + base_url + "/" + url),
-            callback=callback)
+            callback=callback,
+            meta={'extra_data': True},
+            dont_filter=True)
         return request_with_cookies
 
     def start_requests(self):
         while self.urls.__len__() > 0:
             url = self.urls.pop()
-            yield self.request(url, self.parse)
+            for request in self.schedule(url):
+                yield request
+
+    def schedule(self, url):
+        # Every listing page is requested once, whether it came from fanout or from the next link
+        key = url_utils.strip_fragment(url)
+        if key in self.scheduled:
+            return
+        self.scheduled.add(key)
+        yield self.request(url, self.parse)
+
+    def fanout(self, url, current_page, last_page):
+        # Enqueue all remaining listing pages as soon as the first response tells the last page number
+        self.fanout_done = True
+        for page in range(max(current_page, 1) + 1, last_page + 1):
+            offset = self.first_offset + self.page_size * (page - 2)
+            for request in self.schedule(url_utils.get_listing_page_url(url, offset)):
+                yield request
 
     def parse(self, response):
         self.scraped_pages = self.scraped_pages + 1
+        extra_data = response.meta.get('extra_data', False)
         provinces = response.css('ul.geoList li')
         provinces_obj = []
         for province in provinces:
@@ -86,22 +112,35 @@ class ProvincesSpider(scrapy.Spider):
         except:
             self.log('Provinces: %s/%s' % (current_page, last_page))
 
-        if self.extra_data:
+        if extra_data:
             current_page = self.extra_data_pages
 
-        filename = 'scraped_data/data_provinces/%s/provinces-%s-%s.csv' % (settings.COUNTRY, province_group_name, current_page)
-        with open(filename, 'w') as f:
-            f.write(Province.get_csv_header())
-            for province in provinces_obj:
-                f.write(province.get_csv_line())
-            f.close()
-        self.log('Saved file %s' % filename)
-
-        if next_page is not None and not self.extra_data:
-            yield self.request(next_page, self.parse)
-
-        if (next_page is None or self.extra_data is True) and self.extra_data_pages < 1:
-            self.extra_data = True
+        country = settings.COUNTRY_NAMES.get(settings.COUNTRY, settings.COUNTRY)
+        for province in provinces_obj:
+            yield ProvinceItem.from_row(province.get_db_row(country))
+
+        if settings.CSV_OUTPUT:
+            filename = 'scraped_data/data_provinces/%s/provinces-%s-%s.csv' % (settings.COUNTRY, province_group_name, current_page)
+            with open(filename, 'w') as f:
+                f.write(Province.get_csv_header())
+                for province in provinces_obj:
+                    f.write(province.get_csv_line())
+                f.close()
+            self.log('Saved file %s' % filename)
+
+        if not extra_data and not self.fanout_done:
+            try:
+                for request in self.fanout(response.url.replace(self.root_url, ""), int(current_page),
+                                           int(last_page)):
+                    yield request
+            except (TypeError, ValueError):
+                self.log('Fanout not possible: %s/%s' % (current_page, last_page))
+
+        if next_page is not None and not extra_data:
+            for request in self.schedule(next_page):
+                yield request
+
+        if (next_page is None or extra_data) and self.extra_data_pages < 1:
             self.extra_data_pages += 1
             root = "missing_data/" + settings.COUNTRY
             files = listdir(root)
@@ -7,8 +7,11 @@ import functools
 from scrapy_splash import SplashRequest
 
 from masters.data_structures.Review import Review
+from masters.items import ReviewItem
+from masters.data_managers.utils import database_utils
 from masters.gecko_spiders import reviews_gecko
-from masters.utils import unicode_utils, coordinate_utils, file_utils
+from masters.managers import fingerprint_manager
+from masters.utils import unicode_utils, coordinate_utils, file_utils, url_utils
 from masters import settings
 from os import listdir
 
@@ -20,20 +23,87 @@ class ReviewsSpider(scrapy.Spider):
     urls = []
     parent_url = ""
 
-    def __init__(self, location='', **kwargs):
+    def __init__(self, location='', fanout='', concurrency='', incremental='', start_page='', end_page='',
+                 **kwargs):
         # print(location)
+        # fanout: schedule all review pages once the first page is parsed,
+        # at most `concurrency` pages of one location are requested at the same time
+        # incremental: stop at the first page with only known reviews (turns fanout off)
+        # start_page, end_page: scrap only shard of pages [start_page, end_page)
         self.parent_url = location
         self.start_time = time.time()
-        self.urls.append(location)
+        self.urls = [location]
         self.scraped_pages = 0
+        self.fanout = settings.REVIEWS_FANOUT or fanout in ('1', 'true', 'True')
+        self.location_concurrency = int(concurrency or settings.REVIEWS_LOCATION_CONCURRENCY)
+        self.fanout_pages = {}
+        self.start_page = int(start_page or 1)
+        self.end_page = int(end_page) if end_page else None
+        self.known_ids = {}
+        if settings.REVIEWS_INCREMENTAL or incremental in ('1', 'true', 'True'):
+            self.fanout = False
+            for url in self.urls:
+                self.known_ids[url] = database_utils.load_known_review_ids(url, [settings.COUNTRY])
         super(ReviewsSpider, self).__init__(**kwargs)
 
-    def request(self, url, callback):
+    def request(self, url, callback, parent_url=None, dont_filter=False, errback=None):
+        # Incremental refresh downloads pages again, new reviews moved older ones to the next pages
+        if parent_url is None:
+            parent_url = url
         request_with_cookies = scrapy.Request(
             url=(self.root_url + url),
-            callback=callback)
+            callback=callback,
+            errback=errback,
+            meta={'parent_url': parent_url},
+            dont_filter=dont_filter or bool(self.known_ids))
         return request_with_cookies
 
+    def get_shard_last_page(self, last_page):
+        if self.end_page is not None:
+            return min(last_page, self.end_page - 1)
+        return last_page
+
+    def start_fanout(self, parent_url, current_url, last_page):
+        # Pages after the first one are handed out one by one, so only location_concurrency of them are in flight
+        last_page = self.get_shard_last_page(last_page)
+        urls = [url_utils.get_review_page_url(current_url, page) for page in range(self.start_page + 1, last_page + 1)]
+        self.fanout_pages[parent_url] = iter(
+            [url for url in urls if not fingerprint_manager.is_fetched(self.root_url + url)])
+        self.log('Fanout of %s review pages for %s' % (last_page - self.start_page, parent_url))
+        for _ in range(self.location_concurrency):
+            for request in self.next_fanout_request(parent_url):
+                yield request
+
+    def next_fanout_request(self, parent_url):
+        pages = self.fanout_pages.get(parent_url)
+        if pages is None:
+            return
+        url = next(pages, None)
+        if url is None:
+            del self.fanout_pages[parent_url]
+            return
+        # Pages were checked against downloaded ones already, a filtered request would never be replaced
+        yield self.request(url, self.parse, parent_url, dont_filter=True, errback=self.fanout_failed)
+
+    def fanout_failed(self, failure):
+        # Page failed after retries, next page of the location takes its place
+        parent_url = failure.request.meta['parent_url']
+        self.logger.error("Review page %s failed: %s" % (failure.request.url, repr(failure.value)))
+        for request in self.next_fanout_request(parent_url):
+            yield request
+
+    def skip_fetched_pages(self, url, last_page):
+        # First page from url on which was not downloaded before, None when all of them up to last_page were
+        if self.known_ids:
+            return url
+        page = url_utils.get_review_page_number(url)
+        while fingerprint_manager.is_fetched(self.root_url + url):
+            if page >= last_page:
+                return None
+            page += 1
+            url = url_utils.get_review_page_url(url, page)
+        return url
+
     # request_with_cookies.cookies['TALanguage'] = 'ALL'
     # request_with_cookies.cookies[
     #     'TAReturnTo'] = '%1%%2FAttraction_Review%3FreqNum%3D1%26isLastPoll%3Dfalse%26filterLang%3DALL%26filterSegment%3D%26changeSet%3DREVIEW_LIST%26g%3D644300%26q%3D%26t%3D%26puid%3DXExNFQokH20AAYnnbnQAAACo%26preferFriendReviews%3DFALSE%26trating%3D%26d%3D7289577%26filterSeasons%3D%26waitTime%3D19%26paramSeqId%3D10'
@@ -54,10 +124,12 @@ class ReviewsSpider(scrapy.Spider):
         for url in self.urls:
             # self.current_review_coordinates = reviews_gecko.get_coordinates(self.root_url + url)
             # yield self.splash_request(url, self.parse)
-            yield self.request(url, self.parse)
+            # First page is always downloaded, it tells how many pages the location has
+            yield self.request(url_utils.get_review_page_url(url, self.start_page), self.parse, url, dont_filter=True)
 
     def parse(self, response):
         self.scraped_pages = self.scraped_pages + 1
+        parent_url = response.meta['parent_url']
         next_href = response.css('div.ui_pagination a.next::attr(href)').extract_first()
         if next_href is not None:
             next_review_page_url = unicode_utils.unicode_to_string(next_href)
@@ -71,17 +143,21 @@ class ReviewsSpider(scrapy.Spider):
         other_photos = response.css('div.b2oaw8yU').extract_first()
         if review_location_name is None and other_title is None and other_photos is None:
             print("Retrying(1) " + current_url)
-            yield self.request(current_url, self.parse)
+            yield self.request(current_url, self.parse, parent_url, dont_filter=True,
+                               errback=response.request.errback)
             return
         if other_title is not None:
             self.log("Not correct review page to scrap, skipping...")
+            for request in self.next_fanout_request(parent_url):
+                yield request
             return
         review_current_page = unicode_utils.unicode_to_string(
             response.css('div.pageNumbers span.current::text').extract_first())
         reviews = response.css('div.main_content div.Dq9MAugU')
         if review_current_page is None and len(reviews) > 5:
             print("Retrying(2)" + current_url)
-            yield self.request(current_url, self.parse)
+            yield self.request(current_url, self.parse, parent_url, dont_filter=True,
+                               errback=response.request.errback)
             return
         review_last_page = unicode_utils.unicode_list_to_string(
             response.css('div.pageNumbers a.pageNum::text').extract()[-1:])
@@ -135,7 +211,8 @@ class ReviewsSpider(scrapy.Spider):
                                  user_name,
                                  user_link,
                                  user_id,
-                                 self.parent_url)
+                                 "None",
+                                 parent_url)
             reviews.append(review_data)
 
         no_reviews = False
@@ -155,7 +232,8 @@ class ReviewsSpider(scrapy.Spider):
                                  "None",
                                  "None",
                                  "None",
-                                 self.parent_url)
+                                 "None",
+                                 parent_url)
             reviews.append(review_data)
             no_reviews = True
 
@@ -164,19 +242,23 @@ class ReviewsSpider(scrapy.Spider):
         if review_current_page is not None:
             review_current_page = review_current_page.replace("/", "")
 
-        if review_current_page == '1':
+        if review_current_page == '1' and not self.fanout and not self.known_ids and self.end_page is None:
             last_scraped_page_url = file_utils.get_last_scraped_page_url(review_location_name, current_url)
             if last_scraped_page_url is not None:
                 next_review_page_url = last_scraped_page_url
 
-        filename = 'scraped_data/data_reviews/%s/reviews-%s-%s.csv' % (
-            settings.COUNTRY, review_location_name, review_current_page)
-        with open(filename, 'w') as f:
-            f.write(Review.get_csv_header_v2())
-            for review in reviews:
-                f.write(review.get_csv_line())
-            f.close()
-        self.log('Saved %s reviews to file %s' % (len(reviews), filename))
+        for review in reviews:
+            yield ReviewItem.from_row(review.get_db_row())
+
+        if settings.CSV_OUTPUT:
+            filename = 'scraped_data/data_reviews/%s/reviews-%s-%s.csv' % (
+                settings.COUNTRY, review_location_name, review_current_page)
+            with open(filename, 'w') as f:
+                f.write(Review.get_csv_header_v2())
+                for review in reviews:
+                    f.write(review.get_csv_line())
+                f.close()
+            self.log('Saved %s reviews to file %s' % (len(reviews), filename))
 
         try:
             current_time = time.time()
@@ -191,8 +273,25 @@ class ReviewsSpider(scrapy.Spider):
             self.log('Reviews: %s/%s' % (review_current_page, review_last_page))
         if no_reviews:
             self.log("Location had no reviews. None values with coords were collected.")
-        if next_review_page_url is not "":
-            yield self.request(next_review_page_url, self.parse)
+        if Review.only_known(reviews, self.known_ids.get(parent_url)):
+            self.log("Only known reviews on page %s, location is up to date" % review_current_page)
+        elif self.fanout:
+            if review_current_page == str(self.start_page) and review_last_page.isdigit() \
+                    and int(review_last_page) > self.start_page:
+                for request in self.start_fanout(parent_url, current_url, int(review_last_page)):
+                    yield request
+            else:
+                for request in self.next_fanout_request(parent_url):
+                    yield request
+        elif review_current_page is not None and review_current_page.isdigit() \
+                and int(review_current_page) >= self.get_shard_last_page(int(review_current_page) + 1):
+            self.log("Last page of shard reached")
+        elif next_review_page_url != "":
+            if review_last_page.isdigit():
+                next_review_page_url = self.skip_fetched_pages(
+                    next_review_page_url, self.get_shard_last_page(int(review_last_page)))
+            if next_review_page_url is not None:
+                yield self.request(next_review_page_url, self.parse, parent_url)
 
     def retry_page(self, url):
-        yield self.request(url, self.parse)
+        yield self.request(url, self.parse, dont_filter=True)
@@ -1,6 +1,7 @@
 import sys
 from os import listdir
 from masters.utils import unicode_utils
+from masters.managers import crawl_state_manager
 
 import functools
 
@@ -8,19 +9,7 @@ sys.path.append("..")
 
 
 def location_scraped(string):
-    filename = 'logs/scraped_locations.log'
-    with open(filename) as f:
-        is_scraped = string in f.read()
-        f.close()
-        return is_scraped
-
-
-def location_overkill(string):
-    filename = 'logs/to_scrap.log'
-    with open(filename) as f:
-        is_overkill = string in f.read()
-        f.close()
-        return is_overkill
+    return crawl_state_manager.is_scraped(string)
 
 def get_last_scraped_page_url(review_location_name, url):
     # https://www.tripadvisor.com/Attraction_Review-g60763-d105127-Reviews-or74990-Central_Park-New_York_City_New_York.html#REVIEWS
@@ -0,0 +1,59 @@
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def get_process_tree_rss(pid):
+    # Resident memory in MB of process pid together with all of its child processes
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+        except psutil.Error:
+            return 0
+        rss = 0
+        for p in processes:
+            try:
+                rss += p.memory_info().rss
+            except psutil.Error:
+                pass
+        return rss / 1024 / 1024
+    return sum(map(get_process_rss, get_process_tree(pid))) / 1024
+
+
+def get_process_tree(pid):
+    pids = [pid]
+    for child in get_process_children(pid):
+        pids += get_process_tree(child)
+    return pids
+
+
+def get_process_children(pid):
+    children = []
+    root = "/proc/%s/task" % pid
+    try:
+        tasks = os.listdir(root)
+    except OSError:
+        return children
+    for task in tasks:
+        try:
+            with open(root + "/" + task + "/children") as f:
+                children += [int(child) for child in f.read().split()]
+        except OSError:
+            pass
+    return children
+
+
+def get_process_rss(pid):
+    # Resident memory in kB read from /proc/<pid>/status
+    try:
+        with open("/proc/%s/status" % pid) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
@@ -0,0 +1,28 @@
+def to_int(value):
+    # None for missing values ("None", "", None) and values which are not numbers
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        number = to_float(value)
+        if number is None:
+            return None
+        return int(number)
+
+
+def to_float(value):
+    if value is None or isinstance(value, float):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_text(value):
+    if value is None or value == "None":
+        return None
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return str(value)
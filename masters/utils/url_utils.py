@@ -0,0 +1,74 @@
+import re
+
+from masters import settings
+
+# https://www.tripadvisor.com/Attraction_Review-g60763-d105127-Reviews-or74990-Central_Park-New_York_City_New_York.html#REVIEWS
+review_offset_pattern = re.compile(r"-Reviews-or\d+-")
+# https://www.tripadvisor.com/Attractions-g274862-Activities-oa70-Slovenia.html#LOCATION_LIST
+listing_offset_pattern = re.compile(r"-Activities-(oa\d+-)?")
+# https://www.tripadvisor.co.uk, https://tripadvisor.com, ...
+host_pattern = re.compile(r"^https?://(www\.)?tripadvisor\.[a-z.]+", re.IGNORECASE)
+canonical_host = "https://www.tripadvisor.com"
+# Attraction_Review-g60763-d105127-... -> geo id 60763 (city/province), detail id 105127 (location)
+geo_id_pattern = re.compile(r"-g(\d+)-")
+detail_id_pattern = re.compile(r"-d(\d+)-")
+
+
+def strip_fragment(url):
+    return url.split("#")[0]
+
+
+def get_geo_id(url):
+    # Integer geo id of province/location url, None when url has none
+    match = geo_id_pattern.search(url or "")
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def get_location_id(url):
+    # Integer detail id of location (attraction) url, None when url has none
+    match = detail_id_pattern.search(url or "")
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def canonicalize_url(url):
+    # Absolute url of the page on tripadvisor.com without fragment and zero offsets, other urls only lose the fragment
+    url = strip_fragment(url)
+    url = host_pattern.sub("", url)
+    if not url.startswith("/"):
+        return url
+    url = url.replace("-Reviews-or0-", "-Reviews-").replace("-Activities-oa0-", "-Activities-")
+    return canonical_host + url
+
+
+def get_review_base_url(url):
+    # Review url of the first page, without the -orNNN- offset and fragment
+    return review_offset_pattern.sub("-Reviews-", strip_fragment(url))
+
+
+def get_review_page_url(url, page):
+    # Review url of page (1 based) using the -Reviews-orNNN- offset scheme
+    url = get_review_base_url(url)
+    if page <= 1:
+        return url
+    tmp = url.split("-Reviews-")
+    return tmp[0] + "-Reviews-or" + str((page - 1) * settings.REVIEWS_PAGE_SIZE) + "-" + tmp[1]
+
+
+def get_review_page_number(url):
+    # Page (1 based) of a review url using the -Reviews-orNNN- offset scheme
+    match = review_offset_pattern.search(url)
+    if match is None:
+        return 1
+    return int(match.group(0)[len("-Reviews-or"):-1]) // settings.REVIEWS_PAGE_SIZE + 1
+
+
+def get_listing_page_url(url, offset):
+    # Attractions listing url with the -Activities-oaNNN- offset (offset 0 is the first page)
+    url = strip_fragment(url)
+    if offset > 0:
+        return listing_offset_pattern.sub("-Activities-oa" + str(offset) + "-", url, count=1)
+    return listing_offset_pattern.sub("-Activities-", url, count=1)